@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+build.py
+
+This schedules the compile and link commands needed to turn the generated
+sources into runners. Every output is built exactly once, and commands whose
+inputs are ready are run concurrently. The same steps can be written out as a
+build.ninja or Makefile, so that a hand-edited source can be rebuilt without
+rebuilding everything else.
+"""
+
+import concurrent.futures
+import os.path
+import re
+import subprocess
+import threading
+import time
+
+
+# the headers a generated source includes from its own directory
+local_include_pattern = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.MULTILINE)
+
+
+def get_local_includes(source):
+    # the headers alongside the source which it includes directly
+    try:
+        with open(source) as f:
+            text = f.read()
+    except OSError:
+        return []
+    directory = os.path.dirname(source)
+    headers = [os.path.join(directory, name) for name in local_include_pattern.findall(text)]
+    return [header for header in headers if os.path.exists(header)]
+
+
+def escape_ninja_path(path):
+    return path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+
+
+def escape_make_path(path):
+    return path.replace("$", "$$").replace(" ", "\\ ").replace(":", "\\:")
+
+
+class BuildFailed(Exception):
+    """Raised when a compile or link command fails"""
+    def __init__(self, command, output=""):
+        self.command = command
+        self.output = output
+        msg = "Build command failed: " + command
+        if output:
+            msg += "\n" + output
+        super().__init__(msg)
+
+
+class BuildStep:
+
+    output = None
+    command = None
+    dependencies = None
+    # how long the last run took, in seconds
+    duration = None
+
+    def __init__(self, output, command, dependencies):
+        self.output = output
+        self.command = command
+        self.dependencies = list(dependencies)
+
+    def is_compile(self):
+        return "-c" in self.command.split()
+
+    def run(self, cache=None, stopping=None):
+        started = time.perf_counter()
+        try:
+            return self.run_command(cache, stopping)
+        finally:
+            self.duration = time.perf_counter() - started
+
+    def run_command(self, cache=None, stopping=None):
+        key = None
+        if cache and self.is_compile():
+            key = cache.get_key(self.command)
+            if key and cache.fetch(key, self.output):
+                return ""
+        # the build is being abandoned, so don't start anything new
+        if stopping is not None and stopping.is_set():
+            return ""
+        result = subprocess.run(
+            self.command.split(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            raise BuildFailed(self.command, result.stdout)
+        if key:
+            cache.store(key, self.output)
+        return result.stdout
+
+
+class BuildScheduler:
+
+    def __init__(self, jobs=1, cache=None):
+        self.jobs = max(1, jobs or 1)
+        self.cache = cache
+        # insertion ordered, so this doubles as a valid serial build order
+        self.steps = {}
+        # source -> the local headers it includes; see get_inputs
+        self.includes = {}
+
+    def add(self, output, command, dependencies=()):
+        # every output gets built once, no matter how many things need it
+        if output in self.steps:
+            if self.steps[output].command == command:
+                return output
+            # a different command for the same output replaces the old one,
+            # just as rerunning it by hand would have
+            del self.steps[output]
+        self.steps[output] = BuildStep(output, command, dependencies)
+        return output
+
+    def commands(self):
+        return [step.command for step in self.steps.values()]
+
+    def get_inputs(self, step):
+        # (explicit, implicit) inputs: what the command names, and every
+        # header a compile includes, however indirectly, so that editing one
+        # rebuilds everything using it
+        explicit = list(step.dependencies)
+        implicit = set()
+        if step.is_compile():
+            pending = [d for d in explicit if d not in self.steps]
+            while pending:
+                source = pending.pop()
+                if source not in self.includes:
+                    self.includes[source] = get_local_includes(source)
+                for header in self.includes[source]:
+                    if header not in implicit:
+                        implicit.add(header)
+                        pending.append(header)
+        return explicit, sorted(implicit.difference(explicit))
+
+    def write_ninja(self, path):
+        lines = [
+            "# Generated by fffc. Rebuilds whatever in this directory is out of",
+            "# date; name an output to rebuild only what it needs.",
+            "",
+            "rule run",
+            "  command = $cmd",
+            "  description = $out",
+            # Without this, ninja would rebuild everything the first time
+            # for want of a log of how it was built. The commands only ever
+            # change when fffc rewrites this file.
+            "  generator = 1",
+            "",
+        ]
+        for step in self.steps.values():
+            explicit, implicit = self.get_inputs(step)
+            line = "build %s: run" % escape_ninja_path(step.output)
+            for dependency in explicit:
+                line += " " + escape_ninja_path(dependency)
+            if implicit:
+                line += " | " + " ".join(escape_ninja_path(h) for h in implicit)
+            lines.append(line)
+            lines.append("  cmd = " + step.command.replace("$", "$$"))
+        lines.append("")
+        with open(str(path), "w") as f:
+            f.write("\n".join(lines))
+
+    def write_makefile(self, path):
+        outputs = [escape_make_path(step.output) for step in self.steps.values()]
+        lines = [
+            "# Generated by fffc. Rebuilds whatever in this directory is out of",
+            "# date; name an output to rebuild only what it needs.",
+            "",
+            ".PHONY: all",
+            "all: " + " ".join(outputs),
+            "",
+        ]
+        for step in self.steps.values():
+            explicit, implicit = self.get_inputs(step)
+            inputs = [escape_make_path(d) for d in explicit + implicit]
+            lines.append("%s: %s" % (escape_make_path(step.output), " ".join(inputs)))
+            lines.append("\t" + step.command.replace("$", "$$"))
+            lines.append("")
+        with open(str(path), "w") as f:
+            f.write("\n".join(lines))
+
+    def _is_ready(self, step, done):
+        # dependencies which aren't build outputs are sources, and are ready
+        for dependency in step.dependencies:
+            if dependency in self.steps and dependency not in done:
+                return False
+        return True
+
+    def run(self):
+        pending = list(self.steps.values())
+        done = set()
+        running = {}
+        # set once a step fails; see BuildStep.run_command
+        stopping = threading.Event()
+        # compiler processes do the real work, so threads are enough to keep
+        # a full pool of them busy
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for step in [s for s in pending if self._is_ready(s, done)]:
+                    if len(running) >= self.jobs:
+                        break
+                    pending.remove(step)
+                    running[pool.submit(step.run, self.cache, stopping)] = step
+                if not running:
+                    raise Exception("Build steps have circular dependencies.", pending)
+                finished, _= concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        output = future.result()
+                    except BuildFailed:
+                        # Fail fast: nothing else is submitted, and steps
+                        # which were submitted but haven't started their
+                        # command yet skip it. Commands which have started
+                        # can't be stopped, and the pool waits for them to
+                        # finish before this gets raised.
+                        stopping.set()
+                        raise
+                    if output:
+                        print(output, end="")
+                    done.add(step.output)
+        if self.cache:
+            self.cache.trim()
+            print("Object cache: %d hits, %d misses" % (self.cache.hits, self.cache.misses))
+            self.cache.hits = self.cache.misses = 0
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+cache.py
+
+A persistent, content-addressed cache of compiled objects. Objects are keyed by
+the hash of their preprocessed source, the command used to compile them and
+the compiler it runs, so a source which regenerates byte-for-byte identically
+is never recompiled. The output directory is left out of the key, so that the
+same source generated into another directory is found too.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+
+
+class ObjectCache:
+
+    # 1GB is plenty for several large targets' worth of mutators
+    default_max_size = 1024 * 1024 * 1024
+
+    def __init__(self, path, max_size=None):
+        self.path = Path(path)
+        self.max_size = max_size or self.default_max_size
+        self.hits = 0
+        self.misses = 0
+        # compiles run on several threads at once, and share these
+        self.lock = threading.Lock()
+        # compiler -> its identity; see get_compiler_identity
+        self.compilers = {}
+        os.makedirs(str(self.path), exist_ok=True)
+
+    def _preprocess(self, args):
+        # the same command, but stopping after the preprocessor and writing
+        # the result to stdout
+        args = list(args)
+        out = args.index("-o")
+        del args[out:out + 2]
+        args[args.index("-c")] = "-E"
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return None
+        return result.stdout
+
+    def _identify(self, compiler):
+        h = hashlib.sha256()
+        path = shutil.which(compiler)
+        if path:
+            path = os.path.realpath(path)
+            st = os.stat(path)
+            h.update(("%s %d %d" % (path, st.st_size, st.st_mtime_ns)).encode())
+        result = subprocess.run([compiler, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        h.update(result.stdout)
+        return h.digest()
+
+    def get_compiler_identity(self, compiler):
+        # What the compiler says it is, and the size and mtime of the file it
+        # resolves to, so that objects it compiled aren't reused once it's
+        # replaced. Each compiler is only asked once per run.
+        with self.lock:
+            identity = self.compilers.get(compiler)
+            if identity is None:
+                identity = self._identify(compiler)
+                self.compilers[compiler] = identity
+        return identity
+
+    def get_key(self, command):
+        args = command.split()
+        preprocessed = self._preprocess(args)
+        if preprocessed is None:
+            return None
+        # The output's directory is in the command and in the preprocessor's
+        # line markers, but not in anything the object is compiled from.
+        directory = os.path.dirname(args[args.index("-o") + 1])
+        if directory:
+            command = command.replace(directory, "")
+            preprocessed = preprocessed.replace(directory.encode(), b"")
+        h = hashlib.sha256()
+        h.update(self.get_compiler_identity(args[0]))
+        h.update(command.encode())
+        h.update(b"\0")
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return self.path / key[:2] / (key + ".o")
+
+    def fetch(self, key, output):
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(str(entry), output)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+        # bump the entry so it is the last to be evicted
+        os.utime(str(entry))
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, output):
+        entry = self._entry(key)
+        os.makedirs(str(entry.parent), exist_ok=True)
+        # copy then rename, so that nobody ever sees half an object
+        fd, tmp = tempfile.mkstemp(dir=str(entry.parent), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(output, tmp)
+        os.replace(tmp, str(entry))
+
+    def trim(self):
+        entries = []
+        total = 0
+        for entry in self.path.glob("*/*.o"):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        # least recently used first
+        for mtime, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
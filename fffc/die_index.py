@@ -0,0 +1,412 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+die_index.py
+
+A compact index of the DIEs in a compile unit. Rather than parsing every DIE
+into an object and keeping it around, this walks the raw .debug_info bytes
+using just the abbreviation table, remembering only the integer offsets of the
+DIEs worth coming back to. Everything else is parsed on demand, and the DIEs
+read most often can be decoded into compact records instead.
+"""
+
+import array
+from collections import namedtuple
+
+from elftools.common.utils import struct_parse
+from elftools.dwarf.enums import ENUM_DW_FORM
+
+
+# Forms whose size doesn't depend on the CU
+fixed_form_sizes = {
+    "DW_FORM_data1": 1,
+    "DW_FORM_ref1": 1,
+    "DW_FORM_flag": 1,
+    "DW_FORM_strx1": 1,
+    "DW_FORM_addrx1": 1,
+    "DW_FORM_data2": 2,
+    "DW_FORM_ref2": 2,
+    "DW_FORM_strx2": 2,
+    "DW_FORM_addrx2": 2,
+    "DW_FORM_strx3": 3,
+    "DW_FORM_addrx3": 3,
+    "DW_FORM_data4": 4,
+    "DW_FORM_ref4": 4,
+    "DW_FORM_strx4": 4,
+    "DW_FORM_addrx4": 4,
+    "DW_FORM_ref_sup4": 4,
+    "DW_FORM_data8": 8,
+    "DW_FORM_ref8": 8,
+    "DW_FORM_ref_sig8": 8,
+    "DW_FORM_ref_sup8": 8,
+    "DW_FORM_data16": 16,
+    "DW_FORM_flag_present": 0,
+    "DW_FORM_implicit_const": 0,
+}
+
+# Forms which are a section offset, and so are 4 or 8 bytes depending on
+# whether the CU is 32 or 64-bit DWARF
+offset_forms = {
+    "DW_FORM_strp",
+    "DW_FORM_line_strp",
+    "DW_FORM_sec_offset",
+    "DW_FORM_strp_sup",
+    "DW_FORM_GNU_ref_alt",
+    "DW_FORM_GNU_strp_alt",
+}
+
+# Forms which are a single LEB128 number
+leb128_forms = {
+    "DW_FORM_udata",
+    "DW_FORM_sdata",
+    "DW_FORM_ref_udata",
+    "DW_FORM_strx",
+    "DW_FORM_addrx",
+    "DW_FORM_loclistx",
+    "DW_FORM_rnglistx",
+    "DW_FORM_GNU_addr_index",
+    "DW_FORM_GNU_str_index",
+}
+
+# Forms which index the CU's string offsets, or its addresses; the sizes are
+# those of the index
+indexed_string_forms = {"DW_FORM_strx": None, "DW_FORM_strx1": 1, "DW_FORM_strx2": 2, "DW_FORM_strx3": 3, "DW_FORM_strx4": 4}
+indexed_address_forms = {"DW_FORM_addrx": None, "DW_FORM_addrx1": 1, "DW_FORM_addrx2": 2, "DW_FORM_addrx3": 3, "DW_FORM_addrx4": 4}
+
+# Forms prefixed with their length
+block_forms = {
+    "DW_FORM_block1": 1,
+    "DW_FORM_block2": 2,
+    "DW_FORM_block4": 4,
+}
+
+
+form_names = {code: name for name, code in ENUM_DW_FORM.items() if type(code) == int}
+
+# The attributes read from the members, enumerators, parameters and subranges
+# of the types being converted, which is where most DIEs are
+record_attributes = {
+    "DW_AT_name",
+    "DW_AT_type",
+    "DW_AT_byte_size",
+    "DW_AT_bit_size",
+    "DW_AT_data_member_location",
+    "DW_AT_declaration",
+    "DW_AT_external",
+    "DW_AT_low_pc",
+    "DW_AT_const_value",
+    "DW_AT_upper_bound",
+    "DW_AT_count",
+}
+
+# Forms whose values are plain unsigned numbers
+unsigned_forms = {
+    "DW_FORM_data1",
+    "DW_FORM_data2",
+    "DW_FORM_data4",
+    "DW_FORM_data8",
+    "DW_FORM_ref1",
+    "DW_FORM_ref2",
+    "DW_FORM_ref4",
+    "DW_FORM_ref8",
+    "DW_FORM_ref_addr",
+    "DW_FORM_addr",
+    "DW_FORM_sec_offset",
+}
+
+# Only the parts of a pyelftools AttributeValue that anything reads
+RecordAttribute = namedtuple("RecordAttribute", ["name", "form", "value"])
+
+
+def read_uleb128(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class DieLayout:
+    """What the abbreviation table says about one kind of DIE"""
+
+    def __init__(self, tag, has_children, attribute_names, sizes, specs):
+        self.tag = tag
+        self.has_children = has_children
+        self.attribute_names = attribute_names
+        # the size of each attribute, or its form if that isn't fixed. Runs of
+        # fixed-size attributes are merged, so a DIE made entirely of them is
+        # skipped in one step.
+        self.sizes = sizes
+        # (name, form, implicit value) for each attribute, in order
+        self.specs = specs
+
+
+class DieRecord:
+    """The attributes of a DIE that fffc reads, decoded in one pass
+
+    It has enough of the interface of a pyelftools DIE for the accessors in
+    utilities, and for walking a DIE's children.
+    """
+
+    __slots__ = ("offset", "tag", "has_children", "size", "attributes")
+
+    def __init__(self, offset, tag, has_children, size, attributes):
+        self.offset = offset
+        self.tag = tag
+        self.has_children = has_children
+        self.size = size
+        self.attributes = attributes
+
+    def is_null(self):
+        return self.tag is None
+
+
+class DieIndex:
+
+    def __init__(self, cu, bases=None):
+        self.cu = cu
+        self.base = cu.cu_offset
+        stream = cu.dwarfinfo.debug_info_sec.stream
+        stream.seek(self.base)
+        self.data = stream.read(cu.size)
+        self.abbrevs = cu.get_abbrev_table()
+        self.layouts = {}
+        self.offset_size = 8 if cu.dwarf_format() == 64 else 4
+        self.address_size = cu["address_size"]
+        self.byteorder = "little" if cu.structs.little_endian else "big"
+        if cu["version"] == 2:
+            self.ref_addr_size = self.address_size
+        else:
+            self.ref_addr_size = self.offset_size
+        # where the CU's string offsets and addresses start, once needed,
+        # unless they're implied by something other than the CU
+        self.bases = bases
+
+    def get_form_size(self, form):
+        if form in fixed_form_sizes:
+            return fixed_form_sizes[form]
+        if form in offset_forms:
+            return self.offset_size
+        if form == "DW_FORM_addr":
+            return self.address_size
+        if form == "DW_FORM_ref_addr":
+            return self.ref_addr_size
+        return None
+
+    def get_layout(self, code):
+        try:
+            return self.layouts[code]
+        except KeyError:
+            pass
+        decl = self.abbrevs.get_abbrev(code)
+        names = set()
+        sizes = []
+        specs = []
+        for spec in decl["attr_spec"]:
+            name, form = spec.name, spec.form
+            names.add(name)
+            specs.append((name, form, spec.value if form == "DW_FORM_implicit_const" else None))
+            size = self.get_form_size(form)
+            if size is None:
+                sizes.append(form)
+            elif sizes and type(sizes[-1]) == int:
+                sizes[-1] += size
+            else:
+                sizes.append(size)
+        layout = DieLayout(decl["tag"], decl.has_children(), names, sizes, specs)
+        self.layouts[code] = layout
+        return layout
+
+    def skip_form(self, form, pos):
+        data = self.data
+        if form in leb128_forms:
+            while data[pos] & 0x80:
+                pos += 1
+            return pos + 1
+        if form == "DW_FORM_string":
+            return data.index(b"\0", pos) + 1
+        if form in block_forms:
+            length_size = block_forms[form]
+            length = int.from_bytes(data[pos:pos + length_size], self.byteorder)
+            return pos + length_size + length
+        if form in ("DW_FORM_block", "DW_FORM_exprloc"):
+            length, pos = read_uleb128(data, pos)
+            return pos + length
+        if form == "DW_FORM_indirect":
+            code, pos = read_uleb128(data, pos)
+            form = form_names[code]
+            size = self.get_form_size(form)
+            if size is not None:
+                return pos + size
+            return self.skip_form(form, pos)
+        # anything else is rare enough to leave to pyelftools
+        return self.parse_form(form, pos)[1]
+
+    def parse_form(self, form, pos):
+        # The value of an attribute as pyelftools parses it, and the position
+        # after it
+        stream = self.cu.dwarfinfo.debug_info_sec.stream
+        value = struct_parse(self.cu.structs.Dwarf_dw_form[form], stream, self.base + pos)
+        return value, stream.tell() - self.base
+
+    def skip_die(self, pos):
+        # Returns the layout of the DIE at pos (None for a null DIE) and the
+        # position just past it, not counting its children.
+        code, pos = read_uleb128(self.data, pos)
+        if code == 0:
+            return None, pos
+        layout = self.get_layout(code)
+        for size in layout.sizes:
+            if type(size) == int:
+                pos += size
+            else:
+                pos = self.skip_form(size, pos)
+        return layout, pos
+
+    def read_form(self, form, pos, implicit):
+        # Returns the value pyelftools would have for an attribute of this
+        # form, and the position after it, or None for the value if it's a
+        # form which isn't decoded here.
+        data = self.data
+        if form in unsigned_forms:
+            size = self.get_form_size(form)
+            return int.from_bytes(data[pos:pos + size], self.byteorder), pos + size
+        if form in ("DW_FORM_udata", "DW_FORM_ref_udata"):
+            return read_uleb128(data, pos)
+        if form == "DW_FORM_sdata":
+            value, end = read_uleb128(data, pos)
+            bits = 7 * (end - pos)
+            if value & (1 << (bits - 1)):
+                value -= 1 << bits
+            return value, end
+        if form == "DW_FORM_flag":
+            return data[pos] != 0, pos + 1
+        if form == "DW_FORM_flag_present":
+            return True, pos
+        if form == "DW_FORM_implicit_const":
+            return implicit, pos
+        if form == "DW_FORM_string":
+            end = data.index(b"\0", pos)
+            return data[pos:end], end + 1
+        if form in indexed_string_forms or form in indexed_address_forms:
+            return self.read_indexed(form, pos)
+        if form in ("DW_FORM_strp", "DW_FORM_line_strp"):
+            size = self.offset_size
+            offset = int.from_bytes(data[pos:pos + size], self.byteorder)
+            dwarfinfo = self.cu.dwarfinfo
+            if form == "DW_FORM_strp":
+                return dwarfinfo.get_string_from_table(offset), pos + size
+            return dwarfinfo.get_string_from_linetable(offset), pos + size
+        return None, pos
+
+    def get_bases(self):
+        # (string offsets base, address base) from the top DIE, either of
+        # which is None if the CU doesn't have one
+        if self.bases is None:
+            attributes = self.cu.get_top_DIE().attributes
+            bases = []
+            for name in ("DW_AT_str_offsets_base", "DW_AT_addr_base"):
+                attr = attributes.get(name)
+                bases.append(attr.value if attr else None)
+            self.bases = tuple(bases)
+        return self.bases
+
+    def read_indexed(self, form, pos):
+        # Strings and addresses which are indices, as the clang and split
+        # DWARF 5 use for most of them. They're None when the CU doesn't say
+        # what they're relative to.
+        size = indexed_string_forms.get(form) or indexed_address_forms.get(form)
+        if size is None:
+            index, end = read_uleb128(self.data, pos)
+        else:
+            index = int.from_bytes(self.data[pos:pos + size], self.byteorder)
+            end = pos + size
+        string_base, address_base = self.get_bases()
+        dwarfinfo = self.cu.dwarfinfo
+        if form in indexed_string_forms:
+            if string_base is None:
+                return None, end
+            stream = dwarfinfo.debug_str_offsets_sec.stream
+            stream.seek(string_base + index * self.offset_size)
+            offset = int.from_bytes(stream.read(self.offset_size), self.byteorder)
+            return dwarfinfo.get_string_from_table(offset), end
+        if address_base is None or not dwarfinfo.debug_addr_sec:
+            return None, end
+        stream = dwarfinfo.debug_addr_sec.stream
+        stream.seek(address_base + index * self.address_size)
+        return int.from_bytes(stream.read(self.address_size), self.byteorder), end
+
+    def get_record(self, offset):
+        # The DIE at offset as a DieRecord, or None if one of its attributes
+        # has to be parsed the slow way.
+        start = pos = offset - self.base
+        code, pos = read_uleb128(self.data, pos)
+        if code == 0:
+            return DieRecord(offset, None, False, pos - start, {})
+        layout = self.get_layout(code)
+        attributes = {}
+        for name, form, implicit in layout.specs:
+            if name in record_attributes:
+                value, pos = self.read_form(form, pos, implicit)
+                if value is None:
+                    return None
+                attributes[name] = RecordAttribute(name, form, value)
+                continue
+            size = self.get_form_size(form)
+            if size is not None:
+                pos += size
+            else:
+                pos = self.skip_form(form, pos)
+        return DieRecord(offset, layout.tag, layout.has_children, pos - start, attributes)
+
+    def get_die(self, offset):
+        # The DIE at offset as a DieRecord with all of its attributes, for
+        # CUs whose DIEs pyelftools can't read by itself.
+        start = pos = offset - self.base
+        code, pos = read_uleb128(self.data, pos)
+        if code == 0:
+            return DieRecord(offset, None, False, pos - start, {})
+        layout = self.get_layout(code)
+        attributes = {}
+        for name, form, implicit in layout.specs:
+            value, end = self.read_form(form, pos, implicit)
+            if value is None and form not in indexed_string_forms and form not in indexed_address_forms:
+                value, end = self.parse_form(form, pos)
+            attributes[name] = RecordAttribute(name, form, value)
+            pos = end
+        return DieRecord(offset, layout.tag, layout.has_children, pos - start, attributes)
+
+    def find(self, tags, attribute):
+        # The offsets of every DIE with one of the given tags and the given
+        # attribute, in order.
+        offsets = array.array("Q")
+        pos = self.cu.cu_die_offset - self.base
+        end = len(self.data)
+        while pos < end:
+            start = pos
+            layout, pos = self.skip_die(pos)
+            if layout is None:
+                continue
+            if layout.tag in tags and attribute in layout.attribute_names:
+                offsets.append(start + self.base)
+        return offsets
+
+    def skip_subtree(self, offset):
+        # The offset just past the DIE at offset and all of its children
+        pos = offset - self.base
+        depth = 0
+        while True:
+            layout, pos = self.skip_die(pos)
+            if layout is None:
+                depth -= 1
+            elif layout.has_children:
+                depth += 1
+            if depth <= 0:
+                return pos + self.base
@@ -12,12 +12,19 @@ types and functions it contains. It also generates the corresponding mutators
 for those types.
 """
 
+import concurrent.futures
+import contextlib
 import glob
+import hashlib
+import multiprocessing
 from pathlib import Path
 import os
 import os.path
+import re
+import shlex
+import tempfile
 
-from elftools.elf.elffile import ELFFile
+from elftools.dwarf.die import DIE
 from elftools.construct.lib.container import ListContainer
 
 from pycparser import c_ast
@@ -25,6 +32,14 @@ from pycparser.c_generator import CGenerator
 
 from .utilities import *
 from .template import *
+from .build import BuildScheduler
+from .die_index import DieIndex
+from .libraries import LibraryResolver, LibraryScreen, NO_ASAN, NO_DWARF, NO_GCOV, QUALIFIES
+from .manifest import CompileUnitSummary, Manifest
+from .mapped_elf import MappedElf
+from .profiling import *
+from .selection import Selection
+from .split_dwarf import SplitDwarf, SplitDwarfNotFound, UnsupportedSplitDwarf, is_skeleton
 
 
 class NotCompiledWithASAN(Exception):
@@ -51,6 +66,14 @@ class NotCompiledWithGcov(Exception):
         super().__init__("ELF " + elf + "was not compiled with gcov info, not fuzzing")
 
 
+class NameCollision(Exception):
+    """Raised when two different mutators or sizeof functions hash to the
+    same name"""
+    def __init__(self, name, first, second):
+        self.name = name
+        super().__init__("%s is the name of both %s and %s" % (name, first, second))
+
+
 class NotWrittenInC(Exception):
     """Raised when an ELF file was not written in C"""
     def __init__(self, elf=""):
@@ -98,36 +121,31 @@ class DwarfType:
         self.status = TypeStatus.DONE
 
     def __repr__(self):
-        location = self.cu_object.get_offset(self.die)
+        location = hex(self.die.offset)
         data = " ".join([str(type(self)), hex(id(self)), str(self.typename), location])
         return "<" + data + ">"
 
     def _get_child_elements_by_tag(self, tag):
-        for child in self.die.iter_children():
-            if child and child.tag == tag:
+        for child in self.cu_object.iter_child_records(self.die):
+            if child.tag == tag:
                 yield child
 
     def _get_type_name(self):
-        try:
-            typename = demand_string_attr(self.die, self.name_attribute)
-            # this is a horrible hack to help fix clang's broken DWARF output
-            if typename == "sizetype":
-                typename = "size_t"
-            return typename
-        except KeyError:
-            return None
+        typename = expect_string_attr(self.die, self.name_attribute)
+        # this is a horrible hack to help fix clang's broken DWARF output
+        if typename == "sizetype":
+            typename = "size_t"
+        return typename
 
     def _get_offset_of_subtype(self, attribute, die=None):
         if not die:
             die = self.die
-        try:
-            # see if we have a type at all
-            raw_offset = demand_attr(die, attribute)
-            raw_offset += self.cu_object.cu.cu_offset
-        except KeyError:
+        # see if we have a type at all
+        raw_offset = expect_attr(die, attribute)
+        if raw_offset is None:
             # this occurs when we have a void subtype
             return None
-        return self.cu_object.format_offset(raw_offset)
+        return raw_offset + self.cu_object.cu.cu_offset
 
     def get_status(self):
         return self.status
@@ -138,6 +156,9 @@ class DwarfType:
     def get_size(self):
         return expect_int_attr(self.die, self.byte_size_attribute)
 
+    def get_signature(self):
+        return self.cu_object.get_type_signature(self.die.offset)
+
     def add_dependency(self, dependency, name=None):
         # we can't add a dependency on nothing
         if not dependency.get_typename():
@@ -345,11 +366,7 @@ class DwarfStructType(DwarfType):
         return members, member_types
 
     def is_declaration(self):
-        try:
-            out = demand_attr(self.die, self.is_declaration_attribute)
-            return True
-        except KeyError:
-            return False
+        return has_attr(self.die, self.is_declaration_attribute)
 
     def build_ast(self, name, typename, members, qualifiers):
         struct_ast = self.constructor(typename, members)
@@ -404,11 +421,7 @@ class DwarfEnumType(DwarfType):
         self.status = TypeStatus.NEW
 
     def is_declaration(self):
-        try:
-            out = demand_attr(self.die, self.is_declaration_attribute)
-            return True
-        except KeyError:
-            return False
+        return has_attr(self.die, self.is_declaration_attribute)
 
     def get_enum_values(self):
         enum_values = []
@@ -484,19 +497,13 @@ class DwarfFunctionType(DwarfType):
         self.status = TypeStatus.NEW
 
     def _parse_external(self):
-        try:
-            # We require both that the external attr be present, indicating that
-            # this function was available to other CUs
-            demand_attr(self.die, self.external_attr)
-            self.external = True
-        except Exception:
-            self.external = False
+        # We require both that the external attr be present, indicating that
+        # this function was available to other CUs
+        self.external = has_attr(self.die, self.external_attr)
 
     def _parse_low_pc(self):
-        try:
-            self.low_pc = demand_attr(self.die, self.low_pc_attr)
-        except Exception:
-            self.low_pc = None
+        self.low_pc = expect_attr(self.die, self.low_pc_attr)
+        if self.low_pc is None:
             self.external = False
 
     def get_return_type(self):
@@ -951,7 +958,8 @@ class InferredHeader:
         self.header_name = self.get_header_name(cu.get_name(), cu.get_cu_offset())
         cu.inferred_header = self
 
-    def get_header_name(self, cu_name, cu_offset):
+    @staticmethod
+    def get_header_name(cu_name, cu_offset):
         munged_name = cu_name.replace(os.path.sep, "_")
         munged_header_name = munged_name.replace(".c", ".h")
         return "_".join([str(cu_offset), munged_header_name])
@@ -969,16 +977,15 @@ class InferredHeader:
         return build_source(self.statements)
 
     def write_header(self):
-        header_outfile = open(str(self.output_dir / self.header_name), "w")
-        header_outfile.write(self.generate_header())
-        header_outfile.close()
+        with open(str(self.output_dir / self.header_name), "w") as header_outfile:
+            write_source(self.statements, header_outfile)
         return self.header_name
 
 
 class DwarfCompileUnit:
 
     cu = None
-    offset_to_die_map = None
+    named_type_offsets = None
     offset_to_type_map = None
 
     # useful properties of the CU
@@ -1016,6 +1023,45 @@ class DwarfCompileUnit:
 
     acceptable_languages = {dwarf_k_and_r_id, dwarf_ansi_id, dwarf_c99_id}
 
+    # These locate things elsewhere in the binary, so they change whenever
+    # anything linked before this CU does. Nothing we generate depends on them
+    # (except for function addresses, which are handled separately).
+    unstable_attributes = {
+        "DW_AT_low_pc",
+        "DW_AT_high_pc",
+        "DW_AT_stmt_list",
+        "DW_AT_ranges",
+        "DW_AT_location",
+        "DW_AT_frame_base",
+        "DW_AT_decl_file",
+        "DW_AT_decl_line",
+        "DW_AT_decl_column",
+        "DW_AT_call_file",
+        "DW_AT_call_line",
+        "DW_AT_call_column",
+    }
+    unstable_forms = {"DW_FORM_sec_offset", "DW_FORM_exprloc"}
+
+    # The children which are part of what a type is, as opposed to (say) the
+    # variables in a function
+    signature_child_tags = {
+        "DW_TAG_member",
+        "DW_TAG_enumerator",
+        "DW_TAG_subrange_type",
+        "DW_TAG_formal_parameter",
+        "DW_TAG_unspecified_parameters",
+    }
+    # A function's type is only its prototype. Its name, its parameters'
+    # names and whether it's external don't change what a pointer to it
+    # holds, so function types which only differ in those share a signature.
+    prototype_tags = {
+        subroutine_tag,
+        subprogram_tag,
+        "DW_TAG_formal_parameter",
+        "DW_TAG_unspecified_parameters",
+    }
+    prototype_attributes = {"DW_AT_type", "DW_AT_prototyped"}
+
     type_tags = {
         base_type_tag: DwarfBaseType,
         enumeration_tag: DwarfEnumType,
@@ -1032,20 +1078,35 @@ class DwarfCompileUnit:
         volatile_tag: DwarfVolatileType,
     }
 
-    def __init__(self, cu):
+    def __init__(self, cu, offset=None, index=None):
         self.cu = cu
-        self.cu_die = self.cu.get_top_DIE()
-        self.offset_to_die_map = {}
+        # where the CU is in the program, which for a split unit is where its
+        # skeleton is rather than where it is in its .dwo
+        self.offset = cu.cu_offset if offset is None else offset
+        # A split unit comes with an index which reads all of its DIEs, since
+        # pyelftools can't without the bases its skeleton implies.
+        self.reads_dies_from_index = index is not None
+        self.index = index or DieIndex(cu)
+        self.cu_die = self.get_die(cu.cu_die_offset)
         self.offset_to_type_map = {}
+        self.type_signatures = {}
         self.name = self.get_name()
-        self.language = expect_string_attr(self.cu_die, self.language_attribute)
-        if self.language not in self.acceptable_languages:
-            raise NotWrittenInC(self.name)
+        self.language = self.check_language(self.cu_die)
         self.compiler = self.get_compiler()
         self.build_dies()
 
+    @classmethod
+    def check_language(cls, cu_die):
+        language = expect_string_attr(cu_die, cls.language_attribute)
+        if language not in cls.acceptable_languages:
+            raise NotWrittenInC(expect_string_attr(cu_die, cls.name_attribute))
+        return language
+
+    def get_compiler_string(self):
+        return expect_string_attr(self.cu_die, self.producer_attribute)
+
     def get_compiler(self):
-        compiler = expect_string_attr(self.cu_die, self.producer_attribute)
+        compiler = self.get_compiler_string()
         if "GNU" in compiler:
             # we're gcc... but what gcc?
             version = compiler.split(" ")[2]
@@ -1057,42 +1118,181 @@ class DwarfCompileUnit:
         raise Exception("Unknown compiler")
 
     def get_cu_offset(self):
-        return hex(self.cu.cu_offset)
+        return hex(self.offset)
+
+    def get_fingerprint(self):
+        # This is the CU's .debug_info, minus anything which only moved.
+        # References are CU-relative and strings are resolved, so an
+        # unchanged source file produces the same fingerprint even when the
+        # files linked before it change.
+        h = hashlib.sha256()
+        h.update(self.get_compiler_string().encode())
+        for die in self.iter_dies():
+            h.update(b"\0" + str(die.tag).encode())
+            for name, attr in die.attributes.items():
+                h.update(b"\1" + str(name).encode())
+                if name in self.unstable_attributes or attr.form in self.unstable_forms:
+                    continue
+                h.update(b"\2" + repr(attr.value).encode())
+        return h.hexdigest()
+
+    def get_type_signature(self, offset):
+        # A digest of the layout of the type at offset and everything it's
+        # built from, which comes out the same in every CU which defines it
+        # the same way.
+        signature = self.type_signatures.get(offset)
+        if signature is None:
+            t = self.offset_to_type_map.get(offset)
+            h = hashlib.blake2b(digest_size=16)
+            self._update_type_signature(h, t.die if t else self.get_die(offset))
+            signature = self.type_signatures[offset] = h.hexdigest()
+        return signature
+
+    def _get_type_ref(self, attr):
+        offset = attr.value
+        if attr.form != "DW_FORM_ref_addr":
+            offset += self.cu.cu_offset
+        return offset
+
+    def get_reachable_type_offsets(self, offsets):
+        # every type the DIEs at offsets are built from, pointers included
+        reachable = set()
+        pending = list(offsets)
+        while pending:
+            offset = pending.pop()
+            if offset in reachable:
+                continue
+            reachable.add(offset)
+            dies = [self.get_die(offset)]
+            while dies:
+                die = dies.pop()
+                attr = die.attributes.get("DW_AT_type")
+                if attr is not None:
+                    pending.append(self._get_type_ref(attr))
+                dies.extend(c for c in self.iter_children(die) if c.tag in self.signature_child_tags)
+        return reachable
+
+    def _update_type_signature(self, h, die):
+        h.update(b"\0" + str(die.tag).encode())
+        prototype = die.tag in self.prototype_tags
+        for name, attr in die.attributes.items():
+            if name in self.unstable_attributes or attr.form in self.unstable_forms:
+                continue
+            if prototype and name not in self.prototype_attributes:
+                continue
+            if name != "DW_AT_type":
+                if not attr.form.startswith("DW_FORM_ref"):
+                    h.update(b"\2" + str(name).encode() + b"=" + repr(attr.value).encode())
+            elif die.tag == self.pointer_tag:
+                self._update_pointee_signature(h, self._get_type_ref(attr))
+            else:
+                h.update(b"\1" + self.get_type_signature(self._get_type_ref(attr)).encode())
+        for child in self.iter_children(die):
+            if child.tag in self.signature_child_tags:
+                self._update_type_signature(h, child)
+        h.update(b"\3")
+
+    def _update_pointee_signature(self, h, offset):
+        # Every cycle in a C type goes through a pointer, and a pointer's
+        # mutator only reaches what it points to by name, so only the name
+        # goes into the signature.
+        while True:
+            die = self.get_die(offset)
+            h.update(b"\4" + str(die.tag).encode())
+            name = expect_string_attr(die, self.name_attribute)
+            if name or "DW_AT_type" not in die.attributes:
+                h.update(b"=" + (name or "").encode())
+                return
+            offset = self._get_type_ref(die.attributes["DW_AT_type"])
+
+    def get_function_addresses(self):
+        addresses = {}
+        for die in self.iter_dies():
+            if die.tag != self.subprogram_tag:
+                continue
+            name = expect_string_attr(die, self.name_attribute)
+            low_pc = expect_attr(die, "DW_AT_low_pc")
+            if name and low_pc is not None:
+                addresses[name] = low_pc
+        return addresses
 
     def get_name(self):
         return expect_string_attr(self.cu_die, self.name_attribute)
 
     def add_type_object_from_die(self, die):
         t = self.type_tags[die.tag](die, self)
-        self.offset_to_type_map[self.get_offset(die)] = t
+        self.offset_to_type_map[die.offset] = t
         return t
 
     def get_or_add_type(self, offset):
         try:
             return self.offset_to_type_map[offset]
         except KeyError:
-            die = self.offset_to_die_map[offset]
+            die = self.get_die(offset)
             return self.add_type_object_from_die(die)
 
-    def format_offset(self, raw_offset):
-        return str(hex(raw_offset))
+    # pyelftools caches every DIE it parses for as long as the CU is around,
+    # which for a big CU is most of our memory. So DIEs are parsed directly
+    # instead, and only kept by the types made from them.
+
+    def get_die(self, offset):
+        if self.reads_dies_from_index:
+            return self.index.get_die(offset)
+        return DIE(self.cu, self.cu.dwarfinfo.debug_info_sec.stream, offset)
+
+    def iter_dies(self):
+        # every DIE in the CU, in order, including the null DIEs which end
+        # each list of children
+        offset = self.cu.cu_die_offset
+        end = self.cu.cu_offset + self.cu.size
+        while offset < end:
+            die = self.get_die(offset)
+            yield die
+            offset += die.size
+
+    def iter_child_records(self, die):
+        # iter_children, but only with the attributes most things need
+        if not die.has_children:
+            return
+        offset = die.offset + die.size
+        while True:
+            child = self.index.get_record(offset) or self.get_die(offset)
+            if child.is_null():
+                return
+            yield child
+            if child.has_children:
+                offset = self.index.skip_subtree(offset)
+            else:
+                offset += child.size
 
-    def get_offset(self, die):
-        return self.format_offset(die.offset)
+    def iter_children(self, die):
+        if not die.has_children:
+            return
+        offset = die.offset + die.size
+        while True:
+            child = self.get_die(offset)
+            if child.is_null():
+                return
+            yield child
+            if child.has_children:
+                offset = self.index.skip_subtree(offset)
+            else:
+                offset += child.size
 
     def build_dies(self):
-        for die in self.cu.iter_DIEs():
-            offset = self.get_offset(die)
-            self.offset_to_die_map[offset] = die
+        # Named types are the only DIEs we go looking for; everything else is
+        # reached by reference from one of them.
+        self.named_type_offsets = self.index.find(self.type_tags, self.name_attribute)
 
     def get_named_types(self):
-        for offset, die in self.offset_to_die_map.items():
-            name = expect_string_attr(die, "DW_AT_name")
+        for offset in self.named_type_offsets:
+            t = self.offset_to_type_map.get(offset)
+            die = t.die if t else self.get_die(offset)
+            name = expect_string_attr(die, self.name_attribute)
             if not name:
                 continue
-            if die.tag not in self.type_tags:
-                continue
-            t = self.get_or_add_type(offset)
+            if not t:
+                t = self.add_type_object_from_die(die)
             if t.get_status() == TypeStatus.DONE:
                 continue
             tdecl = t.define(name)
@@ -1181,12 +1381,57 @@ class Runner:
         with open(str(runlib_source_path), "w") as f:
             f.write(runlib_source)
 
-    def get_compile_command(self):
-        source = str(self.runlib_name.with_suffix(".c"))
-        out = str(self.runlib_name.with_suffix(".o"))
-        cmd = self.compile_command.format(out=out, source=source)
+    @classmethod
+    def get_compile_command_for(cls, runlib_name):
+        source = str(runlib_name.with_suffix(".c"))
+        out = str(runlib_name.with_suffix(".o"))
+        cmd = cls.compile_command.format(out=out, source=source)
         return out, cmd
 
+    def get_compile_command(self):
+        return self.get_compile_command_for(self.runlib_name)
+
+
+class MutatorHeader:
+    """mutator.h, which declares every mutator in the program exactly once"""
+
+    def __init__(self, path):
+        self.path = path
+        # mangled name -> declaration, in the order they were first added
+        self.decls = {}
+        self.added_size = 0
+
+    @staticmethod
+    def uncomment(decl):
+        return re.sub(r"/\*.*?\*/", "", decl, flags=re.DOTALL).strip()
+
+    @classmethod
+    def get_decl_name(cls, decl):
+        # the name being declared, ignoring any comment in front of it
+        match = re.search(r"(\w+)\s*\(", cls.uncomment(decl))
+        if match:
+            return match.group(1)
+        return decl
+
+    def add(self, decls):
+        for decl in decls:
+            self.added_size += len(decl) + 3
+            name = self.get_decl_name(decl)
+            first = self.decls.setdefault(name, decl)
+            # Names are hashes of what they're for, so the same name declared
+            # differently is two things hashing alike.
+            if first != decl and self.uncomment(first) != self.uncomment(decl):
+                raise NameCollision(name, self.uncomment(first), self.uncomment(decl))
+
+    def write(self):
+        # returns how much duplicate text was left out
+        written_size = 0
+        with open(str(self.path), "w") as f:
+            for decl in self.decls.values():
+                f.write(decl + ";\n\n")
+                written_size += len(decl) + 3
+        return self.added_size - written_size
+
 
 class Mutator:
 
@@ -1197,35 +1442,48 @@ class Mutator:
     decls = None
     defns = None
 
-    mutated_types = set()
+    mutated_types = None
+
+    # the functions a mutator definition defines start at the beginning of a line
+    defined_name_pattern = re.compile(
+        r"^[^\s/].*?\b((?:_Z_fffc_mutator_|fffc_get_sizeof_)\w+)\s*\(", re.MULTILINE
+    )
+    # and what it's for shows in what it takes
+    defined_prototype_pattern = re.compile(
+        r"^[^\s/].*?\b((?:_Z_fffc_mutator_|fffc_get_sizeof_)\w+)\s*(\(.*\))", re.MULTILINE
+    )
+    # and every one it calls or defines appears like this
+    used_name_pattern = re.compile(r"\b((?:_Z_fffc_mutator_|fffc_get_sizeof_)\w+)\s*\(")
 
-    def __init__(self, header_path, outdir):
+    def __init__(self, header_path, outdir, source_suffix="_mutator.c"):
         self.output_dir = outdir
         self.inferred_header_path = header_path
         self.source_path = outdir / self.inferred_header_path.replace(
-            ".h", "_mutator.c"
+            ".h", source_suffix
         )
-        self.header_path = self.output_dir / "mutator.h"
         self.decls = []
         self.defns = []
+        # [key, defined names, defn] for each definition; see
+        # Executable.write_mutator_sources
+        self.entries = []
+        # type -> the names its mutator defines, if it got one
+        self.mutated_types = {}
 
     def generate_include(self, filename):
         return '#include "' + filename + '"\n'
 
     def add_mutator(self, type_object):
-        self.mutated_types.add(type_object)
+        self.mutated_types[type_object] = []
         decls, defn = type_object.generate_mutator()
         if all((decls, defn)):
             self.decls.extend(decls)
             self.defns.append(defn)
-
-    def write_header(self):
-        seen = set()
-        with open(str(self.header_path), "a+") as f:
-            for decl in self.decls:
-                if decl not in seen:
-                    f.write(decl + ";\n\n")
-                seen.add(decl)
+            # the same definition of the same type is the same mutator
+            key = hashlib.blake2b(digest_size=16)
+            key.update(defn.encode() + b"\0" + type_object.get_signature().encode())
+            names = self.defined_name_pattern.findall(defn)
+            self.entries.append([key.hexdigest(), names, defn])
+            self.mutated_types[type_object] = names
 
     def write_source(self):
         seen = set()
@@ -1255,14 +1513,47 @@ class Mutator:
             yield t
 
 
+class DefinitionSpool:
+    """Mutator definitions, kept on disk until they're written out
+
+    Each is stored once, however many CUs define it, and all that stays in
+    memory is where to find it.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        # key -> (offset, length)
+        self.extents = {}
+
+    def add(self, key, defn):
+        if key in self.extents:
+            return
+        data = defn.encode()
+        self.file.seek(0, os.SEEK_END)
+        self.extents[key] = (self.file.tell(), len(data))
+        self.file.write(data)
+
+    def get(self, key):
+        offset, length = self.extents[key]
+        self.file.seek(offset)
+        return self.file.read(length).decode()
+
+    def close(self):
+        self.file.close()
+
+
 class Executable:
 
     target_path = None
     exe_path = None
+    elf = None
     elf_info = None
     dwarf_info = None
-    compile_units = None
+    compile_unit_offsets = None
+    definitions = None
     libraries = []
+    # shared by every Executable, so each library is only ever read once
+    library_resolver = LibraryResolver()
 
     # XXX this should probably be a global
     oneshot_compile_command = "cc -Og -g -fPIC -o {out} {source}"
@@ -1270,93 +1561,127 @@ class Executable:
     link_command = (
         "cc -shared -Og -g -fPIC -o {out} {sources} -lsubhook"
     )
+    archive_command = "ar rcs {out} {sources}"
+    mutator_archive_name = "fffc_mutators.a"
+    # everything in the archive, not just what something already needs
+    whole_archive = "-Wl,--whole-archive {archive} -Wl,--no-whole-archive"
+
+    builder = None
+    mutator_header = None
 
-    commands_run = None
+    # what --build-file writes for each tool
+    build_file_names = {"ninja": "build.ninja", "make": "Makefile"}
 
-    def __init__(self, exe, target, output_dir, headers_only, build_dependencies):
+    def __init__(self, exe, target, output_dir, headers_only, build_dependencies, jobs=1, cache=None, incremental=False, shared_mutators=False, selection=None, profile=None, build_file=None):
         self.target_path = Path(target)
         self.exe_path = Path(exe)
         self.output_dir = Path(output_dir)
         self.build_dependencies = build_dependencies
-        if build_dependencies:
-            self.get_libs()
-        try:
-            os.makedirs(str(output_dir))
-        except FileExistsError:
-            pass
-        self.headers_only = headers_only
-        self.target_file = self.target_path.open("rb")
-        self.exe_file = self.exe_path.open("rb")
-        self.elf_info = ELFFile(self.target_file)
-        if not self.elf_info.has_dwarf_info():
-            raise NotCompiledWithDWARF(self.target_path)
-        if not self.built_with_asan():
-            raise NotCompiledWithASAN(self.target_path)
-        if not self.built_with_gcov():
-            raise NotCompiledWithGcov(self.target_path)
-        self.dwarf_info = self.elf_info.get_dwarf_info()
-        self.compile_units = self.get_compile_units()
+        self.profile = profile
+        self.build_file = build_file
+        with self.profiled(ELF_LOAD):
+            if build_dependencies:
+                self.get_libs()
+            try:
+                os.makedirs(str(output_dir))
+            except FileExistsError:
+                pass
+            self.headers_only = headers_only
+            self.elf = MappedElf(self.target_path)
+            self.elf_info = self.elf.elf_file
+            try:
+                if not self.elf_info.has_dwarf_info():
+                    raise NotCompiledWithDWARF(self.target_path)
+                if not self.built_with_asan():
+                    raise NotCompiledWithASAN(self.target_path)
+                if not self.built_with_gcov():
+                    raise NotCompiledWithGcov(self.target_path)
+                self.dwarf_info = self.elf.get_dwarf_info()
+                self.split_dwarf = SplitDwarf(self.target_path, self.dwarf_info)
+                self.selection = selection or Selection()
+                self.compile_unit_offsets = self.get_compile_unit_offsets()
+            except Exception:
+                self.close()
+                raise
         self.asan_location = self.get_asan_lib()
-        self.commands_run = []
+        self.jobs = jobs
+        self.cache = cache
+        self.builder = BuildScheduler(jobs, cache)
         self.pie = self.is_pie()
+        self.incremental = incremental
+        self.shared_mutators = shared_mutators
+        self.shared_mutators_path = None
+        self.manifest = None
+        # ref -> the names of its mutators, for every type any CU mutated
         self.mutated_types = {}
+        # ref -> (CU offset, type offset within it), for every type a CU
+        # couldn't complete
         self.incomplete_types = {}
+        self.definitions = None
+        # the mutators and sizeof functions left out of the archive
+        self.private_names = set()
 
-    def run(self, *args, **kwargs):
-        self.commands_run.append(" ".join(args[0]))
-        subprocess.run(*args, **kwargs)
+    def profiled(self, phase):
+        # a context which records the phase in the profile, if there is one
+        if self.profile:
+            return self.profile.phase(phase)
+        return contextlib.nullcontext()
 
     def get_libs(self):
-        libnames = []
-        cmd = ["ldd", str(self.target_path)]
-        result = subprocess.run(cmd, universal_newlines=True, stdout=subprocess.PIPE)
-        if result.returncode != 0:
-            raise Exception("Unable to run ldd; do you have a working build environment?")
-        for line in result.stdout.splitlines():
-            try:
-                soname, sep, path, addr = line.split()
-                if path == "not":
-                    if addr == "found":
-                        raise Exception("Unable to locate shared library; do you have a running environment?")
-                libnames.append(os.path.realpath(path))
-            except ValueError:
-                continue
-        self.libraries.extend(libnames)
+        self.libraries.extend(self.library_resolver.get_dependencies(str(self.target_path)))
 
-    def build_debuggable_libs(self):
-        ignore = ["asan", "libc", "libdl", "libpthread", "libgcc", "librt"]
+    # the libraries people generally aren't trying to fuzz, so there's no
+    # need to say why they're being skipped
+    quiet_libraries = ["asan", "libc", "libdl", "libm", "libpthread", "libgcc", "librt"]
+
+    # what each library which doesn't qualify would raise if we tried it
+    screen_exceptions = {
+        NO_DWARF: NotCompiledWithDWARF,
+        NO_ASAN: NotCompiledWithASAN,
+        NO_GCOV: NotCompiledWithGcov,
+    }
+
+    def get_debuggable_libs(self):
+        library_screen = LibraryScreen()
+        libnames = []
         for libname in self.libraries:
-            exe = None
-            try:
-                # do not build dependencies when you recurse
-                exe = Executable(str(self.exe_path), libname, self.output_dir, self.headers_only, False)
+            verdict = library_screen.check(libname)
+            if verdict == QUALIFIES:
+                libnames.append(libname)
+            elif verdict in self.screen_exceptions:
+                if not any(quiet in libname for quiet in self.quiet_libraries):
+                    print(self.screen_exceptions[verdict](libname))
+        library_screen.save()
+        return libnames
+
+    def build_debuggable_lib(self, libname, jobs):
+        # Each library gets a directory of its own, since they're built at
+        # the same time and would otherwise fight over mutator.h and friends.
+        output_dir = self.output_dir / Path(libname).name.split(".so")[0]
+        try:
+            # do not build dependencies when you recurse
+            with Executable(str(self.exe_path), libname, output_dir, self.headers_only, False, jobs, self.cache, self.incremental, self.shared_mutators, self.selection, None, self.build_file) as exe:
                 print("Generating runners for %s..." % libname)
                 exe.generate_sources()
-            except NotCompiledWithASAN as exc:
-                # generally speaking people aren't trying to fuzz these. Suppress the output for
-                # legibility.
-                for ign in ignore:
-                    if ign in libname:
-                        found = True
-                if not found:
-                    print(exc)
-            except NotCompiledWithDWARF as exc:
-                # generally speaking people aren't trying to fuzz these. Suppress the output for
-                # legibility.
-                for ign in ignore:
-                    if ign in libname:
-                        found = True
-                if not found:
-                    print(exc)
-            except NotCompiledWithGcov as exc:
-                # generally speaking people aren't trying to fuzz these. Suppress the output for
-                # legibility.
-                for ign in ignore:
-                    if ign in libname:
-                        found = True
-                if not found:
-                    print(exc)
+        except (NotCompiledWithASAN, NotCompiledWithDWARF, NotCompiledWithGcov) as exc:
+            print(exc)
 
+    def build_debuggable_libs(self):
+        libnames = self.get_debuggable_libs()
+        if not libnames:
+            return
+        # split the jobs between the libraries, rather than each taking them all
+        workers = min(self.jobs, len(libnames))
+        jobs = max(1, self.jobs // workers)
+        if workers == 1:
+            for libname in libnames:
+                self.build_debuggable_lib(libname, jobs)
+            return
+        context = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(workers, context, init_library_worker, (self,)) as pool:
+            futures = [pool.submit(build_debuggable_lib_in_worker, libname, jobs) for libname in libnames]
+            for future in futures:
+                future.result()
 
     def built_with_asan(self):
         symbols = self.elf_info.get_section_by_name('.symtab')
@@ -1391,33 +1716,109 @@ class Executable:
         else:
             raise Exception("Couldn't determine whether the binary was PIE or not!")
 
-    def process_compile_unit(self, cu):
-        offset = cu.cu_offset
-        dcu = DwarfCompileUnit(cu)
-        return (offset, dcu)
-
-    def get_compile_units(self):
-        compile_units = []
-        for cu in self.dwarf_info.iter_CUs():
+    def close(self):
+        # Unmaps the ELF and any sections inflated from it, after which its
+        # DWARF can't be read.
+        if self.elf:
+            self.elf.close()
+        if self.definitions:
+            self.definitions.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_compile_unit_offsets(self):
+        # Only the top DIE is read here; the rest of each CU is left until it
+        # is actually processed. If the selected functions can be looked up,
+        # only the CUs defining them are read at all.
+        offsets = []
+        wanted = self.selection.find_function_compile_units(self.elf_info, self.dwarf_info)
+        if wanted is None:
+            cus = self.dwarf_info.iter_CUs()
+        else:
+            cus = (self.dwarf_info.get_CU_at(offset) for offset in sorted(wanted))
+        for cu in cus:
+            top_die = cu.get_top_DIE()
             try:
-                compile_units.append(self.process_compile_unit(cu))
+                if is_skeleton(cu):
+                    # only the top DIE of the split unit is read here, too
+                    top_die = self.split_dwarf.get_split_unit(cu).get_top_DIE()
+                DwarfCompileUnit.check_language(top_die)
+            except (SplitDwarfNotFound, UnsupportedSplitDwarf) as err:
+                print(err)
+                continue
             except NotWrittenInC as err:
                 if "asan" not in err.elf:
                     print(err)
-        return sorted(compile_units)
+                continue
+            if self.selection.wants_compile_unit(top_die):
+                offsets.append(cu.cu_offset)
+        if not offsets and not self.selection.is_everything():
+            print("Nothing in %s matches the selected functions and sources." % self.target_path)
+        return sorted(offsets)
+
+    def get_compile_unit(self, offset):
+        cu = self.dwarf_info.get_CU_at(offset)
+        if is_skeleton(cu):
+            unit = self.split_dwarf.get_split_unit(cu)
+            return DwarfCompileUnit(unit.cu, offset, unit.index)
+        return DwarfCompileUnit(cu)
+
+    def process_compile_unit(self, offset):
+        if self.profile:
+            self.profile.begin_compile_unit(offset)
+        summary = self._process_compile_unit(offset)
+        if self.profile:
+            self.profile.end_compile_unit(summary.name)
+        return summary
+
+    def _process_compile_unit(self, offset):
+        with self.profiled(CU_PARSE):
+            cu = self.get_compile_unit(offset)
+            fingerprint = cu.get_fingerprint() if self.manifest else None
+        if not self.manifest:
+            return self.generate_compile_unit(cu)
+        summary = self.manifest.lookup(fingerprint)
+        if summary:
+            summary = self.reuse_compile_unit(cu, summary)
+        else:
+            summary = self.generate_compile_unit(cu)
+        summary.fingerprint = fingerprint
+        return summary
+
+    def process_compile_units(self):
+        # Yields a summary of each CU, in order. Every CU writes its own
+        # files, so with more than one job they're farmed out to worker
+        # processes and only the summaries come back to be merged.
+        if self.jobs <= 1 or len(self.compile_unit_offsets) <= 1:
+            for offset in self.compile_unit_offsets:
+                yield self.process_compile_unit(offset)
+            return
+        # The workers are forked so that they inherit this Executable rather
+        # than having it pickled over.
+        context = multiprocessing.get_context("fork")
+        with context.Pool(self.jobs, init_worker, (self,)) as pool:
+            for summary, cu_profile in pool.imap(process_compile_unit_in_worker, self.compile_unit_offsets):
+                if cu_profile:
+                    self.profile.add_compile_unit(cu_profile)
+                yield summary
 
     def generate_base_mutators(self):
         # XXX this is pretty hacky
         open(str(self.output_dir / "base.h"), "w+").close()
+        # every mutator gets declared in here; see write_mutator_header
+        self.mutator_header = MutatorHeader(self.output_dir / "mutator.h")
         base_decls, base_defns = BaseMutatorTemplate().inject()
         m = Mutator("base.h", self.output_dir)
         m.decls = base_decls
         m.defns = base_defns
-        m.write_header()
+        self.mutator_header.add(m.decls)
         m.write_source()
         outfile, build_command = m.get_compile_command()
-        self.run(build_command.split(), check=True)
-        return outfile
+        return self.builder.add(outfile, build_command, [str(m.source_path)])
 
     # XXX these should be split into a separate runtime class
     def generate_runtime(self):
@@ -1434,109 +1835,358 @@ class Executable:
         source = str(self.output_dir / "fffc_runtime.c")
         out = str(self.output_dir / "fffc_runtime.o")
         cmd = self.compile_command.format(out=out, source=source)
-        self.run(cmd.split(), check=True)
-        return str(out)
+        return self.builder.add(out, cmd, [source])
 
     def compile_env_adjuster(self):
         source = str(self.output_dir / "env_adjuster.c")
         out = str(self.output_dir / "env_adjuster")
         cmd = self.oneshot_compile_command.format(out=out, source=source)
-        self.run(cmd.split(), check=True)
-        return str(out)
+        return self.builder.add(out, cmd, [source])
+
+    def get_selected_functions(self, cu):
+        for name, runnable in cu.get_runnable_functions():
+            if self.selection.wants_function(name):
+                yield name, runnable
 
     def generate_runners_for_cu(self, inferred_header, cu):
         header = inferred_header.header_name
-        for name, runnable in cu.get_runnable_functions():
+        for name, runnable in self.get_selected_functions(cu):
             yield Runner(name, runnable, str(self.target_path), str(self.exe_path), header, self.output_dir, self.pie)
 
     def generate_mutator_for_cu(self, inferred_header, cu):
         header = inferred_header.header_name
         mutator = Mutator(header, self.output_dir)
-        generator = CGenerator()
+        reachable = None
+        if not self.selection.is_everything():
+            # only what the selected functions' runners can end up mutating
+            functions = [t.die.offset for name, t in self.get_selected_functions(cu)]
+            reachable = cu.get_reachable_type_offsets(functions)
         for t in cu.get_mutable_types():
-            mutator.add_mutator(t)
-            ref = generator.visit(t.get_reference()())
-            self.incomplete_types.pop(ref, None)
+            if reachable is None or t.die.offset in reachable:
+                mutator.add_mutator(t)
         return mutator
 
+    def generate_compile_unit(self, cu):
+        with self.profiled(HEADER_INFERENCE):
+            inferred_header = self.generate_header_for_cu(cu)
+            inferred_header.write_header()
+            cu.get_builtin_types()
+        with self.profiled(MUTATOR_INJECTION):
+            mutator = self.generate_mutator_for_cu(inferred_header, cu)
+        runners = []
+        with self.profiled(RUNNER_RENDERING):
+            for runner in self.generate_runners_for_cu(inferred_header, cu):
+                runner.write_source()
+                runners.append([runner.target_name, runner.target_function.low_pc])
+        summary = CompileUnitSummary(
+            cu.get_name(), cu.get_cu_offset(), inferred_header.header_name, mutator.decls, runners
+        )
+        summary.mutators = mutator.entries
+        # Note the types this CU couldn't complete. Whether any other CU
+        # does can only be known once every CU is done, so their exceptions
+        # are left to define_exceptions.
+        with self.profiled(EXCEPTIONS):
+            generator = CGenerator()
+            for t in mutator.get_mutated_types():
+                ref = generator.visit(t.get_reference()())
+                summary.mutated.append([ref, mutator.mutated_types[t]])
+            mutated = set(ref for ref, names in summary.mutated)
+            for t in cu.get_incomplete_types():
+                ref = generator.visit(t.get_reference()())
+                if ref not in mutated:
+                    # relative to the CU, which may have moved by the time
+                    # a later run reuses this
+                    summary.incomplete.append([ref, t.die.offset - cu.cu.cu_offset])
+        return summary
+
+    def reuse_compile_unit(self, cu, previous):
+        # The sources from last time are still good, but the CU may have moved
+        # (which renames its header) and its functions may have moved (which
+        # changes the addresses baked into its runners). The manifest's own
+        # summary is left alone, since it says what the last run wrote, and
+        # so what to clean up after this one.
+        summary = previous.copy()
+        header = InferredHeader.get_header_name(cu.get_name(), cu.get_cu_offset())
+        renames = {}
+        if header != summary.header:
+            renames[summary.header] = header
+        addresses = cu.get_function_addresses()
+        for runner in summary.runners:
+            name, old_low_pc = runner
+            new_low_pc = addresses.get(name, old_low_pc)
+            runner[1] = new_low_pc
+            self.relocate_source(name + ".c", name + ".c", summary.header, header, old_low_pc, new_low_pc)
+        for old, new in renames.items():
+            self.relocate_source(old, new, summary.header, header)
+        summary.header = header
+        summary.offset = cu.get_cu_offset()
+        print("Reusing unchanged sources for %s" % summary.name)
+        return summary
+
+    def relocate_source(self, old_name, new_name, old_header, new_header, old_low_pc=None, new_low_pc=None):
+        if old_name == new_name and old_header == new_header and old_low_pc == new_low_pc:
+            return
+        with open(str(self.output_dir / old_name)) as f:
+            text = f.read()
+        text = text.replace('#include "%s"' % old_header, '#include "%s"' % new_header)
+        if old_low_pc != new_low_pc:
+            # see fffc_runner.c; this is the only place the address appears
+            old_call = "fffc_get_pointer_to_symbol(%s," % hex(old_low_pc)
+            new_call = "fffc_get_pointer_to_symbol(%s," % hex(new_low_pc)
+            text = text.replace(old_call, new_call)
+        with open(str(self.output_dir / new_name), "w") as f:
+            f.write(text)
+
+    def remove_stale_sources(self, manifest):
+        for name in manifest.get_stale_files():
+            # and the object built from it, which nothing links against now
+            names = [name, name[:-2] + ".o"] if name.endswith(".c") else [name]
+            for name in names:
+                try:
+                    os.unlink(str(self.output_dir / name))
+                except FileNotFoundError:
+                    pass
+
+    def merge_compile_unit(self, summary, runtime, base, linkages):
+        self.mutator_header.add(summary.mutator_decls)
+        for name, low_pc in summary.runners:
+            runlib_name = self.output_dir / name
+            runner_out, runner_cmd = Runner.get_compile_command_for(runlib_name)
+            self.builder.add(runner_out, runner_cmd, [str(runlib_name.with_suffix(".c"))])
+            linkages.append(
+                [
+                    self.link_command,
+                    str(runlib_name.with_suffix(".so")),
+                    runtime,
+                    base,
+                    summary,
+                    runner_out,
+                ]
+            )
+        # later CUs win, just like they would for any other file
+        for ref, type_offset in summary.incomplete:
+            self.incomplete_types[ref] = (int(summary.offset, 16), type_offset)
+        for ref, names in summary.mutated:
+            self.mutated_types.setdefault(ref, set()).update(names)
+        for key, names, defn in summary.mutators:
+            self.definitions.add(key, defn)
+        # Unless the manifest is going to save it, all that's left to do with
+        # the summary is link against it, so only that has to stay in memory.
+        if not self.manifest:
+            summary.release()
+
+    def write_mutator_sources(self, summaries):
+        # A type defined the same way in many CUs (say, in a shared header)
+        # only has its mutator emitted by the first of them. The rest are
+        # linked against the archive of every CU's mutators, and pick it up
+        # from there. Mutator names only say which type they're for, not how
+        # it's laid out, so anything defining a name which means different
+        # things in different CUs is kept private to each of them instead,
+        # and so is anything calling one of those, since the archived copy
+        # would be pulled into runners which don't define what it calls.
+        # Returns the archive, and each CU's private object if it has one.
+        keys_by_name = {}
+        names_by_key = {}
+        for summary in summaries:
+            for key, names, _ in summary.mutators:
+                names_by_key[key] = names
+                for name in names:
+                    keys_by_name.setdefault(name, set()).add(key)
+        private_names = set(name for name, keys in keys_by_name.items() if len(keys) > 1)
+        calls = {}
+        prototypes = {}
+        for key, names in names_by_key.items():
+            defn = self.definitions.get(key)
+            used = Mutator.used_name_pattern.findall(defn)
+            calls[key] = set(used).difference(names)
+            # Names are hashes of what they're for, so the same name taking
+            # something else is two things hashing alike.
+            for name, prototype in Mutator.defined_prototype_pattern.findall(defn):
+                first = prototypes.setdefault(name, prototype)
+                if first != prototype:
+                    raise NameCollision(name, first, prototype)
+        spreading = bool(private_names)
+        while spreading:
+            spreading = False
+            for key, names in names_by_key.items():
+                if private_names.isdisjoint(names) and not private_names.isdisjoint(calls[key]):
+                    private_names.update(names)
+                    spreading = True
+        self.private_names = private_names
+        emitted = set()
+        written = total = 0
+        shared_objects = []
+        private_objects = {}
+        for summary in summaries:
+            shared = Mutator(summary.header, self.output_dir)
+            private = Mutator(summary.header, self.output_dir, "_private_mutator.c")
+            for key, names, _ in summary.mutators:
+                total += 1
+                if not private_names.isdisjoint(names):
+                    private.defns.append(self.definitions.get(key))
+                    written += 1
+                elif key not in emitted:
+                    emitted.add(key)
+                    shared.defns.append(self.definitions.get(key))
+                    written += 1
+            shared.write_source()
+            shared_out, shared_cmd = shared.get_compile_command()
+            shared_objects.append(self.builder.add(shared_out, shared_cmd, [str(shared.source_path)]))
+            if private.defns:
+                private.write_source()
+                private_out, private_cmd = private.get_compile_command()
+                private_objects[summary.header] = self.builder.add(private_out, private_cmd, [str(private.source_path)])
+        if written < total:
+            print("Emitted %d of %d mutator definitions; the rest were identical to ones in other compile units" % (written, total))
+        self.definitions.close()
+        # ar only ever adds to an archive, so start it from scratch
+        archive = str(self.output_dir / self.mutator_archive_name)
+        try:
+            os.unlink(archive)
+        except FileNotFoundError:
+            pass
+        cmd = self.archive_command.format(out=archive, sources=" ".join(shared_objects))
+        return self.builder.add(archive, cmd, shared_objects), private_objects
+
     def generate_header_for_cu(self, cu):
         ih = InferredHeader(cu, self.output_dir)
         cu.get_named_types()
         return ih
 
+    def generate_exception(self, t):
+        if type(t) == DwarfStructType:
+            # build the donothing mutators for incomplete structs
+            decls, defn = DoNothingMutatorTemplate().inject(t)
+        elif type(t) == DwarfUnionType:
+            # build the donothing mutators for incomplete unions
+            decls, defn = DoNothingMutatorTemplate().inject(t)
+        else:
+            # build a real mutator for most types
+            decls, defn = t.generate_mutator()
+        return decls or [], defn or ""
+
+    def generate_exceptions(self, wanted):
+        # Yields (decls, defn) for each of wanted's types, reading each CU
+        # they come from again, once, to find them.
+        by_compile_unit = {}
+        for cu_offset, type_offset in wanted:
+            by_compile_unit.setdefault(cu_offset, []).append(type_offset)
+        for cu_offset, type_offsets in sorted(by_compile_unit.items()):
+            cu = self.get_compile_unit(cu_offset)
+            self.generate_header_for_cu(cu)
+            for type_offset in type_offsets:
+                yield self.generate_exception(cu.get_or_add_type(cu.cu.cu_offset + type_offset))
+
     def define_exceptions(self):
+        # A type some CU completed doesn't need an exception, unless that
+        # CU's mutator for it is private. The runners of CUs which couldn't
+        # complete it get the exception instead, and it's weak so that the
+        # private ones still win in their own runners.
+        wanted = []
+        for ref, place in self.incomplete_types.items():
+            names = self.mutated_types.get(ref)
+            if names is None or not self.private_names.isdisjoint(names):
+                wanted.append(place)
         exception_mutator_decls = []
         exception_mutator_defns = []
-        for ref, t in self.incomplete_types.items():
-            if ref in self.mutated_types:
-                continue
-            if type(t) == DwarfStructType:
-                # build the donothing mutators for incomplete structs
-                decls, defn = DoNothingMutatorTemplate().inject(t)
-            elif type(t) == DwarfUnionType:
-                # build the donothing mutators for incomplete unions
-                decls, defn = DoNothingMutatorTemplate().inject(t)
-            else:
-                # build a real mutator for most types
-                decls, defn = t.generate_mutator()
+        weak_names = set()
+        for decls, defn in self.generate_exceptions(wanted):
+            weak_names.update(self.private_names.intersection(Mutator.defined_name_pattern.findall(defn)))
             exception_mutator_decls.extend(decls)
             exception_mutator_defns.append(defn)
         do_nothing_path = str(self.output_dir / "do_nothing.c")
         with open(str(do_nothing_path), "w+") as f:
             f.write('#include "fffc_runtime.h"\n')
             f.write('#include "mutator.h"\n\n')
+            for name in sorted(weak_names):
+                f.write("#pragma weak %s\n" % name)
             for defn in sorted(set(exception_mutator_defns)):
                 f.write(defn)
-        with open(str(self.output_dir / "mutator.h"), "a+") as f:
-            for decl in sorted(set(exception_mutator_decls)):
-                f.write(decl + ";\n\n")
+        self.mutator_header.add(sorted(set(exception_mutator_decls)))
         # Again, we're actually just replacing ".c" with ".o" here
         do_nothing_binary = do_nothing_path[:-2] + ".o"
         cmd = self.compile_command.format(out=do_nothing_binary, source=do_nothing_path)
-        self.run(cmd.split(), check=True)
-        return do_nothing_binary
+        return self.builder.add(do_nothing_binary, cmd, [do_nothing_path])
 
-    def make_rebuilder_script(self):
+    def write_mutator_header(self):
+        removed = self.mutator_header.write()
+        print("Left %d bytes of duplicate declarations out of mutator.h" % removed)
+
+    def write_build_file(self):
+        path = self.output_dir / self.build_file_names[self.build_file]
+        if self.build_file == "ninja":
+            self.builder.write_ninja(path)
+        else:
+            self.builder.write_makefile(path)
+
+    def make_rebuilder_script(self, lib):
         shell = "#! /bin/sh"
-        return "\n".join([shell] + self.commands_run) + "\n\n"
+        if self.build_file:
+            # only what this runner needs, and only if it's out of date
+            targets = [lib]
+            if self.shared_mutators_path:
+                targets.append(self.shared_mutators_path)
+            command = "%s -C %s %s" % (self.build_file, shlex.quote(str(self.output_dir)), " ".join(shlex.quote(t) for t in targets))
+            return "\n".join([shell, "exec " + command + ' "$@"']) + "\n"
+        return "\n".join([shell] + self.builder.commands()) + "\n\n"
+
+    def get_preload(self, lib):
+        # The runner goes ahead of the shared mutators, so that its private
+        # mutators are the ones used.
+        preload = [self.asan_location, lib]
+        if self.shared_mutators_path:
+            preload.append(self.shared_mutators_path)
+        return " ".join(preload)
 
     def make_run_script(self, lib, env_adjuster):
-        shell = "#! /bin/bash"
-        tracer = "export FFFC_TRACING=Fals"
-        replay = "export FFFC_DEBUG_REPLAY=" + ('/' * 4096)
-        preload = 'ASAN_OPTIONS=detect_leaks=0 LD_PRELOAD="' + " ".join([self.asan_location, lib]) + '"'
-        return shell + "\n" + tracer + "\n" + replay + "\n" + preload + " " + str(self.exe_path.absolute()) + ' "$@"' + "\n" # actually the exe path
+        return run_script_template.render(
+            preload=self.get_preload(lib),
+            exe_path=str(self.exe_path.absolute()), # actually the exe path
+        )
 
     def make_debugger_script(self, lib):
         # makes the gdb script itself, ie, the one the gdb runs
-        preload = 'ASAN_OPTIONS=detect_leaks=0 LD_PRELOAD="' + " ".join([self.asan_location, lib]) + '"'
-        env_setter = "set exec-wrapper env %s" % preload
-        runner = "target exec %s" % str(self.exe_path.absolute()) # actually the exe path
-        fork_follow = "set follow-fork-mode child"
-        unset_lines = "unset env LINES"
-        unset_columns = "unset env COLUMNS"
-        set_progname = "set env _ " + str(self.exe_path.absolute()) # actually the exe path
-        run_cmd = "run\n"
-        return "\n".join([env_setter, runner, fork_follow, unset_lines, unset_columns, set_progname, run_cmd])
+        return debugger_script_template.render(
+            preload=self.get_preload(lib),
+            exe_path=str(self.exe_path.absolute()), # actually the exe path
+        )
 
     def make_debugger_script_runner(self, lib, env_adjuster, gdb_script_path):
         # make the script that runs the gdb script (I know, it's a bit of a two-step)
-        shell = "#! /bin/bash"
-        tracer = "export FFFC_TRACING=True"
-        replay = """export FFFC_DEBUG_REPLAY=$(PAD=$(printf '%0.1s' "/"{1..4096}) ; echo $FFFC_DEBUG_REPLAY${PAD:${#FFFC_DEBUG_REPLAY}})"""
-        shell_script = shell + "\n" + tracer + "\n" + replay + "\ngdb -x " + str(gdb_script_path) + " " + str(self.exe_path.absolute()) + ' "$@"' # actually the exe path
-        return shell_script
-
-    def do_link(self, linkage):
-        link_command, name, runtime, base, mutator_out, mutator_cmd, runner_out, runner_cmd, do_nothing_binary = (
+        return debugger_script_runner_template.render(
+            gdb_script_path=str(gdb_script_path),
+            exe_path=str(self.exe_path.absolute()), # actually the exe path
+        )
+
+    def do_link(self, linkage, mutator_archive, private_mutators):
+        link_command, name, runtime, base, summary, runner_out, do_nothing_binary = (
             linkage
         )
-        self.run(mutator_cmd.split(), check=True)
-        self.run(runner_cmd.split(), check=True)
-        binaries = " ".join([runtime, base, mutator_out, runner_out, do_nothing_binary])
-        cmd = link_command.format(out=name, sources=binaries)
-        self.run(cmd.split(), check=True)
-        return name
+        if self.shared_mutators_path:
+            # everything but the runner itself is preloaded alongside it
+            binaries = [runner_out]
+            if summary.header in private_mutators:
+                binaries.append(private_mutators[summary.header])
+            cmd = link_command.format(out=name, sources=" ".join(binaries))
+            return self.builder.add(name, cmd, binaries + [self.shared_mutators_path])
+        binaries = [runtime, base, runner_out, do_nothing_binary]
+        if summary.header in private_mutators:
+            binaries.insert(2, private_mutators[summary.header])
+        # the archive goes last, so that it supplies whatever's still missing
+        binaries.append(mutator_archive)
+        cmd = link_command.format(out=name, sources=" ".join(binaries))
+        return self.builder.add(name, cmd, binaries)
+
+    def link_shared_mutators(self, runtime, base, do_nothing_binary, mutator_archive):
+        # The runtime and every shared mutator, built once for all the
+        # runners instead of into each of them. It's named for the target,
+        # since the libraries it depends on share its output directory.
+        name = str(self.output_dir / ("libfffc_mutators_%s.so" % self.target_path.name))
+        sources = [runtime, base, do_nothing_binary, self.whole_archive.format(archive=mutator_archive)]
+        cmd = self.link_command.format(out=name, sources=" ".join(sources))
+        self.shared_mutators_path = self.builder.add(
+            name, cmd, [runtime, base, do_nothing_binary, mutator_archive]
+        )
 
     def make_executable(self, strpath):
         os.chmod(strpath, os.stat(strpath).st_mode | 0o111)
@@ -1550,64 +2200,73 @@ class Executable:
         # Build the miscellaneous tools
         self.generate_env_adjuster()
         env_adjuster = self.compile_env_adjuster()
-        self.make_executable(env_adjuster)
 
         # Now build all the inferred pieces
+        if self.incremental:
+            self.manifest = Manifest(
+                self.output_dir, self.target_path, self.exe_path, self.pie, self.selection.describe()
+            )
+            self.manifest.load()
+        # Each CU's summary is merged as soon as it arrives, after which it's
+        # mostly released, so what stays in memory is little more than what
+        # define_exceptions and linking need.
+        self.definitions = DefinitionSpool()
         linkages = []
-        for off, cu in self.compile_units:
-            inferred_header = self.generate_header_for_cu(cu)
-            inferred_header.write_header()
-            cu.get_builtin_types()
-            mutator = self.generate_mutator_for_cu(inferred_header, cu)
-            mutator.write_header()
-            mutator.write_source()
-            mutator_out, mutator_cmd = mutator.get_compile_command()
-            for runner in self.generate_runners_for_cu(inferred_header, cu):
-                runner.write_source()
-                runner_out, runner_cmd = runner.get_compile_command()
-                name = str(self.output_dir / (runner.target_name + ".so"))
-                linkages.append(
-                    [
-                        self.link_command,
-                        name,
-                        runtime,
-                        base,
-                        mutator_out,
-                        mutator_cmd,
-                        runner_out,
-                        runner_cmd,
-                    ]
-                )
-            generator = CGenerator()
-            for t in cu.get_incomplete_types():
-                ref =  generator.visit(t.get_reference()())
-                self.incomplete_types[ref] = t
-            for t in mutator.get_mutated_types():
-                ref = generator.visit(t.get_reference()())
-                self.mutated_types[ref] = t
+        summaries = []
+        for summary in self.process_compile_units():
+            if self.manifest:
+                self.manifest.add(summary)
+            self.merge_compile_unit(summary, runtime, base, linkages)
+            summaries.append(summary)
+        if self.manifest:
+            self.remove_stale_sources(self.manifest)
+            self.manifest.save()
+        with self.profiled(MUTATOR_SOURCES):
+            mutator_archive, private_mutators = self.write_mutator_sources(summaries)
 
         # now build the exceptions
-        do_nothing_binary = self.define_exceptions()
+        with self.profiled(EXCEPTIONS):
+            do_nothing_binary = self.define_exceptions()
+            self.write_mutator_header()
         for linkage in linkages:
             linkage.append(do_nothing_binary)
 
-        # build everything else
-        outlibs = []
-        for l in linkages:
-            outlib = self.do_link(l)
+        # link everything, then run the whole build
+        with self.profiled(BUILD):
+            if self.shared_mutators:
+                self.link_shared_mutators(runtime, base, do_nothing_binary, mutator_archive)
+            outlibs = [self.do_link(l, mutator_archive, private_mutators) for l in linkages]
+            self.builder.run()
+        if self.build_file:
+            self.write_build_file()
+        if self.profile:
+            self.profile.add_build_steps(self.builder.steps.values())
+        self.make_executable(env_adjuster)
+        with self.profiled(SCRIPTS):
+            self.write_scripts(outlibs, env_adjuster)
+
+        # and build for all the depended-upon libraries
+        if self.build_dependencies:
+            with self.profiled(LIBRARIES):
+                self.build_debuggable_libs()
+        if self.profile:
+            self.profile.write(self.output_dir / PROFILE_NAME)
+
+    def write_scripts(self, outlibs, env_adjuster):
+        # build the runner scripts
+        for outlib in outlibs:
             # drop the .so and add "_runner.sh"
             run_script_name = outlib[:-3] + "_runner.sh"
             with open(str(run_script_name), "w") as f:
                 print("Generating", f.name, "...")
                 f.write(self.make_run_script(outlib, env_adjuster))
             self.make_executable(run_script_name)
-            outlibs.append(outlib)
 
         # build the rebuilder script
         for outlib in outlibs:
             rebuilder_script_name = outlib[:-3] + "_rebuild.sh"
             with open(str(rebuilder_script_name), "w") as f:
-                f.write(self.make_rebuilder_script())
+                f.write(self.make_rebuilder_script(outlib))
                 self.make_executable(rebuilder_script_name)
 
         # build the debugger script
@@ -1620,6 +2279,35 @@ class Executable:
                 f.write(self.make_debugger_script_runner(outlib, env_adjuster, debugger_script_name))
                 self.make_executable(debugger_script_runner_name)
 
-        # and build for all the depended-upon libraries
-        if self.build_dependencies:
-            self.build_debuggable_libs()
+
+# The Executable a worker process generates compile units for; see
+# Executable.process_compile_units.
+worker_executable = None
+
+
+def init_worker(exe):
+    # A forked worker reads the ELF through the parent's mapping, which it
+    # can share since nothing but its own streams keep a position in it.
+    global worker_executable
+    worker_executable = exe
+
+
+def process_compile_unit_in_worker(offset):
+    # the CU's profile comes back with it, since the worker's own is lost
+    summary = worker_executable.process_compile_unit(offset)
+    profile = worker_executable.profile
+    return summary, profile.compile_units.pop() if profile else None
+
+
+# The Executable whose libraries a worker process generates fuzzers for; see
+# Executable.build_debuggable_libs.
+library_parent = None
+
+
+def init_library_worker(exe):
+    global library_parent
+    library_parent = exe
+
+
+def build_debuggable_lib_in_worker(libname, jobs):
+    library_parent.build_debuggable_lib(libname, jobs)
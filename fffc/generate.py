@@ -17,7 +17,10 @@ import sys
 import pathlib
 import traceback
 
+from fffc.cache import ObjectCache
 from fffc.dwarf_to_c import Executable
+from fffc.profiling import Profile
+from fffc.selection import Selection
 
 
 DESCRIPTION = "An easy-to-use fuzzer generator for programs written in C."
@@ -31,15 +34,59 @@ def main():
     parser.add_argument(
         "--overwrite", "-O", action="store_true", help="Overwrite an existing output directory."
     )
+    parser.add_argument(
+        "--incremental", "-I", action="store_true",
+        help="Reuse an existing output directory, regenerating only compile units which changed."
+    )
+    parser.add_argument(
+        "--shared-mutators", "-S", action="store_true",
+        help="Build the runtime and mutators once into a shared library preloaded by every runner."
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=1, help="Number of compile units to generate, and commands to build, at once."
+    )
+    parser.add_argument(
+        "--cache-dir", default=os.environ.get("FFFC_CACHE_DIR"),
+        help="Reuse compiled objects from this directory (default: $FFFC_CACHE_DIR, or no cache)."
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=1024, help="Maximum size of the object cache, in MB."
+    )
+    parser.add_argument(
+        "--function", action="append", metavar="PATTERN",
+        help="Only generate fuzzers for functions matching this glob (or regex, if it starts with re:)."
+    )
+    parser.add_argument(
+        "--cu", action="append", metavar="PATTERN",
+        help="Only generate fuzzers for compile units whose name matches this pattern."
+    )
+    parser.add_argument(
+        "--source", action="append", metavar="PATTERN",
+        help="Only generate fuzzers for compile units whose full source path matches this pattern."
+    )
+    parser.add_argument(
+        "--build-file", choices=["ninja", "make"],
+        help="Also write the build as a build.ninja or Makefile, and have the rebuild scripts use it."
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Record the time and memory each phase takes in fffc_profile.json in the output directory."
+    )
     parser.add_argument(
         "targets", nargs="+", help="The program(s) to generate a fuzzer for."
     )
     parser.add_argument("output", help="The destination directory for fuzzers.")
     arguments = parser.parse_args()
 
+    selection = Selection(arguments.function, arguments.cu, arguments.source)
+
+    cache = None
+    if arguments.cache_dir:
+        cache = ObjectCache(arguments.cache_dir, arguments.cache_size * 1024 * 1024)
+
     for target in arguments.targets:
         path = pathlib.Path(arguments.output) / target
-        if path.exists():
+        if path.exists() and not arguments.incremental:
             if not arguments.overwrite:
                 msg = "Cannot continue without clobbering %s. " % str(path)
                 msg += "Please select a different path, or use the --overwrite option."
@@ -54,13 +101,18 @@ def main():
 
     for target in arguments.targets:
         path = pathlib.Path(arguments.output) / target
+        profile = Profile(target) if arguments.profile else None
         try:
             # build the dependencies from the toplevel
-            exe = Executable(target, target, path, arguments.headers_only, True)
-            exe.generate_sources()
+            with Executable(target, target, path, arguments.headers_only, True, arguments.jobs, cache, arguments.incremental, arguments.shared_mutators, selection, profile, arguments.build_file) as exe:
+                exe.generate_sources()
         except Exception as ex:
             traceback.print_exc()
             continue
+        finally:
+            # in case it failed before writing the profile
+            if profile:
+                profile.close()
         Executable.libraries = []
 
 
@@ -0,0 +1,279 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+libraries.py
+
+Finds the libraries a program depends on the way the dynamic loader would,
+and decides which of them are worth generating fuzzers for, without parsing
+any more of them than it takes to tell.
+"""
+
+import json
+import os
+from pathlib import Path
+import struct
+import tempfile
+
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+
+
+# The verdicts, in the order Executable checks for them
+QUALIFIES = "qualifies"
+NO_DWARF = "no dwarf"
+NO_ASAN = "no asan"
+NO_GCOV = "no gcov"
+NOT_ELF = "not elf"
+
+ASAN_SYMBOLS = [b"__asan_init"]
+GCOV_SYMBOLS = [b"__gcov_init", b"__llvm_gcov_init"]
+
+
+class LibraryNotFound(Exception):
+    """Raised when a library a program needs can't be found"""
+    def __init__(self, name, needed_by):
+        self.name = name
+        self.needed_by = needed_by
+        super().__init__("Unable to locate %s, needed by %s" % (name, needed_by))
+
+
+LD_SO_CACHE = "/etc/ld.so.cache"
+LD_SO_CACHE_MAGIC = b"glibc-ld.so.cache1.1"
+
+# where the loader looks once everything else has failed
+DEFAULT_LIBRARY_DIRS = ["/lib64", "/usr/lib64", "/lib", "/usr/lib"]
+
+
+def read_ld_so_cache(path=LD_SO_CACHE):
+    # The library names in the loader's cache, and where each of them is, in
+    # the order the loader tries them.
+    entries = {}
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return entries
+    # old caches put the new format after the old one
+    start = data.find(LD_SO_CACHE_MAGIC)
+    if start < 0:
+        return entries
+    nlibs, = struct.unpack_from("<I", data, start + len(LD_SO_CACHE_MAGIC))
+    header_size = 48
+    entry_size = 24
+    for i in range(nlibs):
+        flags, key, value = struct.unpack_from("<iII", data, start + header_size + i * entry_size)
+        name = data[start + key:data.index(b"\0", start + key)].decode()
+        path = data[start + value:data.index(b"\0", start + value)].decode()
+        entries.setdefault(name, []).append(path)
+    return entries
+
+
+def get_elf_kind(path):
+    # the class, byte order and machine, which a library has to share with
+    # whatever loads it
+    try:
+        with open(path, "rb") as f:
+            ident = f.read(20)
+    except OSError:
+        return None
+    if len(ident) < 20 or ident[:4] != b"\x7fELF":
+        return None
+    machine = ident[18:20] if ident[5] == 1 else ident[19:17:-1]
+    return (ident[4], ident[5], machine)
+
+
+class LibraryResolver:
+    """Finds libraries by their DT_NEEDED names, as the dynamic loader would"""
+
+    def __init__(self, library_path=None, ld_so_cache=LD_SO_CACHE):
+        if library_path is None:
+            library_path = os.environ.get("LD_LIBRARY_PATH", "")
+        self.library_path = [d for d in library_path.replace(";", ":").split(":") if d]
+        self.ld_so_cache_path = ld_so_cache
+        self.ld_so_cache = None
+        # these outlive any one program, since its libraries share so much
+        self.dynamic = {}
+        self.found = {}
+        self.dependencies = {}
+
+    def get_dynamic(self, path):
+        # (needed, rpath, runpath, interpreter) for the ELF at path
+        try:
+            return self.dynamic[path]
+        except KeyError:
+            pass
+        needed = []
+        rpath = []
+        runpath = []
+        interpreter = None
+        origin = os.path.dirname(path)
+        with open(path, "rb") as f:
+            elf = ELFFile(f)
+            for segment in elf.iter_segments():
+                if segment["p_type"] == "PT_INTERP":
+                    interpreter = segment.get_interp_name()
+            dynamic = elf.get_section_by_name(".dynamic")
+            for tag in dynamic.iter_tags() if dynamic else []:
+                if tag.entry.d_tag == "DT_NEEDED":
+                    needed.append(tag.needed)
+                elif tag.entry.d_tag == "DT_RPATH":
+                    rpath.extend(self.expand_path(tag.rpath, origin))
+                elif tag.entry.d_tag == "DT_RUNPATH":
+                    runpath.extend(self.expand_path(tag.runpath, origin))
+        self.dynamic[path] = (needed, rpath, runpath, interpreter)
+        return self.dynamic[path]
+
+    @staticmethod
+    def expand_path(text, origin):
+        dirs = []
+        for d in text.split(":"):
+            if d:
+                dirs.append(d.replace("${ORIGIN}", origin).replace("$ORIGIN", origin))
+        return dirs
+
+    def get_search_path(self, loader, executable):
+        needed, rpath, runpath, interpreter = self.get_dynamic(loader)
+        dirs = []
+        if not runpath:
+            # DT_RPATH is only used when there's no DT_RUNPATH, and the
+            # executable's applies to everything it loads
+            dirs.extend(rpath)
+            if loader != executable and not self.get_dynamic(executable)[2]:
+                dirs.extend(self.get_dynamic(executable)[1])
+        dirs.extend(self.library_path)
+        dirs.extend(runpath)
+        return dirs
+
+    def find(self, name, loader, executable):
+        kind = get_elf_kind(executable)
+        if "/" in name:
+            candidates = [name]
+        else:
+            candidates = [os.path.join(d, name) for d in self.get_search_path(loader, executable)]
+            if self.ld_so_cache is None:
+                self.ld_so_cache = read_ld_so_cache(self.ld_so_cache_path)
+            candidates.extend(self.ld_so_cache.get(name, []))
+            candidates.extend(os.path.join(d, name) for d in DEFAULT_LIBRARY_DIRS)
+        for candidate in candidates:
+            if candidate in self.found:
+                found = self.found[candidate]
+            else:
+                found = self.found[candidate] = get_elf_kind(candidate)
+            if found and found == kind:
+                return os.path.realpath(candidate)
+        raise LibraryNotFound(name, loader)
+
+    def get_dependencies(self, executable):
+        # Everything the executable loads, in the order it loads them, minus
+        # the loader itself.
+        executable = os.path.realpath(executable)
+        if executable in self.dependencies:
+            return self.dependencies[executable]
+        interpreter = self.get_dynamic(executable)[3]
+        loaded = set()
+        if interpreter:
+            loaded.add(os.path.realpath(interpreter))
+        seen_names = set()
+        libraries = []
+        pending = [executable]
+        while pending:
+            loader = pending.pop(0)
+            for name in self.get_dynamic(loader)[0]:
+                if name in seen_names:
+                    continue
+                seen_names.add(name)
+                path = self.find(name, loader, executable)
+                if path in loaded:
+                    continue
+                loaded.add(path)
+                libraries.append(path)
+                pending.append(path)
+        self.dependencies[executable] = libraries
+        return libraries
+
+
+def get_library_cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(cache_home) / "fffc" / "libraries.json"
+
+
+def get_build_id(elf):
+    for section in elf.iter_sections():
+        if section["sh_type"] != "SHT_NOTE":
+            continue
+        for note in section.iter_notes():
+            if note["n_type"] == "NT_GNU_BUILD_ID":
+                return note["n_desc"]
+    return None
+
+
+def has_symbol(elf, names):
+    # Looking the names up in the symbol table would mean parsing every
+    # symbol in it, but they can only be there if they're in its string table.
+    symtab = elf.get_section_by_name(".symtab")
+    if not symtab:
+        return False
+    strings = b"\0" + elf.get_section(symtab["sh_link"]).data()
+    return any(b"\0" + name + b"\0" in strings for name in names)
+
+
+def screen(elf):
+    if not elf.get_section_by_name(".debug_info"):
+        return NO_DWARF
+    if not has_symbol(elf, ASAN_SYMBOLS):
+        return NO_ASAN
+    if not has_symbol(elf, GCOV_SYMBOLS):
+        return NO_GCOV
+    return QUALIFIES
+
+
+class LibraryScreen:
+    """Remembers each library's verdict until the library changes"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else get_library_cache_path()
+        self.verdicts = None
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(str(self.path)) as f:
+                self.verdicts = json.load(f)
+        except (OSError, ValueError):
+            self.verdicts = {}
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            os.makedirs(str(self.path.parent), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(self.path.parent), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.verdicts, f)
+            os.replace(tmp, str(self.path))
+        except OSError:
+            # an unwritable cache just means we screen every time
+            pass
+        self.changed = False
+
+    def check(self, libname):
+        if self.verdicts is None:
+            self.load()
+        st = os.stat(libname)
+        try:
+            with open(libname, "rb") as f:
+                elf = ELFFile(f)
+                build_id = get_build_id(elf)
+                cached = self.verdicts.get(libname)
+                if cached and cached["key"] == [st.st_size, st.st_mtime_ns, build_id]:
+                    return cached["verdict"]
+                verdict = screen(elf)
+        except ELFError:
+            build_id = None
+            verdict = NOT_ELF
+        self.verdicts[libname] = {"key": [st.st_size, st.st_mtime_ns, build_id], "verdict": verdict}
+        self.changed = True
+        return verdict
@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+manifest.py
+
+Records what was generated for each compile unit, so that a later run over the
+same output directory can skip every compile unit that hasn't changed.
+"""
+
+import copy
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_NAME = "fffc_manifest.json"
+
+
+def get_generator_fingerprint():
+    # anything that changes fffc's output invalidates everything it wrote
+    h = hashlib.sha256()
+    package_dir = Path(__file__).parent
+    for path in sorted(package_dir.glob("*.py")) + sorted(package_dir.glob("templates/*")):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+class CompileUnitSummary:
+    """The parts of a generated compile unit that outlive its DWARF"""
+
+    def __init__(self, name, offset, header, mutator_decls, runners):
+        self.name = name
+        self.offset = offset
+        self.fingerprint = None
+        self.header = header
+        self.mutator_decls = mutator_decls
+        # [function name, low_pc] for each runner
+        self.runners = runners
+        # [ref, offset within the CU] for each type which was never completed
+        self.incomplete = []
+        # [ref, defined names] for every type which got a real mutator
+        self.mutated = []
+        # [key, defined names, defn] for each mutator this CU defines
+        self.mutators = []
+
+    def get_files(self):
+        files = [
+            self.header,
+            self.header.replace(".h", "_mutator.c"),
+            self.header.replace(".h", "_private_mutator.c"),
+        ]
+        files.extend(name + ".c" for name, low_pc in self.runners)
+        return files
+
+    def release(self):
+        # Drops everything Executable.merge_compile_unit has already taken
+        # from this, down to the keys of its mutators.
+        self.mutator_decls = []
+        self.incomplete = []
+        self.mutated = []
+        self.mutators = [[key, names, None] for key, names, defn in self.mutators]
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def copy(self):
+        return CompileUnitSummary.from_dict(copy.deepcopy(self.to_dict()))
+
+    @classmethod
+    def from_dict(cls, d):
+        summary = cls(d["name"], d["offset"], d["header"], d["mutator_decls"], d["runners"])
+        summary.fingerprint = d["fingerprint"]
+        summary.incomplete = d["incomplete"]
+        summary.mutated = d["mutated"]
+        summary.mutators = d["mutators"]
+        return summary
+
+
+class Manifest:
+
+    def __init__(self, output_dir, target_path, exe_path, pie, selection=None):
+        self.path = Path(output_dir) / MANIFEST_NAME
+        self.header = {
+            "generator": get_generator_fingerprint(),
+            "target": os.path.abspath(str(target_path)),
+            "exe": os.path.abspath(str(exe_path)),
+            "pie": pie,
+            "selection": selection,
+        }
+        self.previous = {}
+        self.units = []
+
+    def load(self):
+        try:
+            with open(str(self.path)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("header") != self.header:
+            print("Generator or target changed since %s was written; regenerating everything." % self.path)
+            return
+        for d in data["units"]:
+            summary = CompileUnitSummary.from_dict(d)
+            self.previous[summary.fingerprint] = summary
+
+    def lookup(self, fingerprint):
+        return self.previous.get(fingerprint)
+
+    def add(self, summary):
+        self.units.append(summary)
+
+    def get_stale_files(self):
+        previous = set()
+        for summary in self.previous.values():
+            previous.update(summary.get_files())
+        for summary in self.units:
+            previous.difference_update(summary.get_files())
+        return sorted(previous)
+
+    def save(self):
+        data = {"header": self.header, "units": [s.to_dict() for s in self.units]}
+        with open(str(self.path), "w") as f:
+            json.dump(data, f)
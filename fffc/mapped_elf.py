@@ -0,0 +1,220 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+mapped_elf.py
+
+Reads ELF files through a read-only mapping of them, so that their DWARF is
+read out of the page cache as it's needed rather than each debug section
+being copied into memory up front. Compressed debug sections are inflated a
+chunk at a time into memory of their own, which is the only copy made of
+them, and zstd ones can be read if the zstandard module is installed.
+"""
+
+import mmap
+import os
+import struct
+import zlib
+
+from elftools.common.exceptions import ELFError
+from elftools.common.utils import struct_parse
+from elftools.dwarf.dwarfinfo import DebugSectionDescriptor, DWARFInfo, DwarfConfig
+from elftools.elf.elffile import ELFFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# How much compressed data is read, or inflated, at a time
+CHUNK_SIZE = 1024 * 1024
+
+# SHF_COMPRESSED sections' ch_type, as pyelftools gives it; it doesn't know
+# the name of zstd's
+compression_types = {
+    "ELFCOMPRESS_ZLIB": "zlib",
+    2: "zstd",
+}
+
+# The DWARFInfo arguments, and the sections they're read from
+dwarf_sections = {
+    "debug_info_sec": ".debug_info",
+    "debug_aranges_sec": ".debug_aranges",
+    "debug_abbrev_sec": ".debug_abbrev",
+    "debug_str_sec": ".debug_str",
+    "debug_line_sec": ".debug_line",
+    "debug_frame_sec": ".debug_frame",
+    "debug_loc_sec": ".debug_loc",
+    "debug_ranges_sec": ".debug_ranges",
+    "debug_pubtypes_sec": ".debug_pubtypes",
+    "debug_pubnames_sec": ".debug_pubnames",
+    "debug_addr_sec": ".debug_addr",
+    "debug_str_offsets_sec": ".debug_str_offsets",
+    "debug_line_str_sec": ".debug_line_str",
+    "debug_loclists_sec": ".debug_loclists",
+    "debug_rnglists_sec": ".debug_rnglists",
+    "debug_sup_sec": ".debug_sup",
+    "gnu_debugaltlink_sec": ".gnu_debugaltlink",
+    # loaded with the program, so never compressed
+    "eh_frame_sec": ".eh_frame",
+}
+
+
+class UnsupportedCompression(Exception):
+    """Raised for debug sections compressed in a way fffc can't inflate"""
+    def __init__(self, section, reason):
+        self.section = section
+        super().__init__("Can't inflate %s: %s" % (section, reason))
+
+
+class SectionStream:
+    """A file-like view of part of a mapping, which copies only what's read"""
+
+    def __init__(self, mapping, start, size):
+        self.mapping = mapping
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.pos = offset
+        return offset
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        start = min(self.pos, self.size)
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        self.pos = end
+        return self.mapping[self.start + start:self.start + end]
+
+
+def read_chunks(stream, start, end):
+    while start < end:
+        stream.seek(start)
+        chunk = stream.read(min(CHUNK_SIZE, end - start))
+        if not chunk:
+            return
+        start += len(chunk)
+        yield chunk
+
+
+def inflate_zlib(chunks):
+    # zlib can be told how much to inflate at once, so that one very well
+    # compressed chunk can't become one enormous string
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def inflate_zstd(name, chunks):
+    if zstandard is None:
+        raise UnsupportedCompression(name, "it's compressed with zstd; install zstandard to read it")
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def inflate_section(elf, section):
+    # The section's contents, inflated straight into an anonymous mapping of
+    # the size its header gives, as (mapping, size).
+    start = section["sh_offset"]
+    end = start + section["sh_size"]
+    if section.compressed:
+        header = struct_parse(elf.structs.Elf_Chdr, elf.stream, start)
+        start += elf.structs.Elf_Chdr.sizeof()
+        size = header["ch_size"]
+        kind = compression_types.get(header["ch_type"])
+        if kind is None:
+            raise UnsupportedCompression(section.name, "unknown compression type %s" % header["ch_type"])
+    else:
+        # the older .zdebug sections, which are "ZLIB" and then their size
+        elf.stream.seek(start)
+        magic = elf.stream.read(4)
+        if magic != b"ZLIB":
+            raise UnsupportedCompression(section.name, "unknown compression format %r" % magic)
+        size = struct.unpack(">Q", elf.stream.read(8))[0]
+        start += 12
+        kind = "zlib"
+    chunks = read_chunks(elf.stream, start, end)
+    pieces = inflate_zlib(chunks) if kind == "zlib" else inflate_zstd(section.name, chunks)
+    # mmap won't make an empty mapping
+    inflated = mmap.mmap(-1, max(size, 1))
+    for piece in pieces:
+        if inflated.tell() + len(piece) > size:
+            inflated.close()
+            raise UnsupportedCompression(section.name, "it inflates to more than the %d bytes it should" % size)
+        inflated.write(piece)
+    if inflated.tell() != size:
+        inflated.close()
+        raise UnsupportedCompression(section.name, "it inflates to %d bytes, not %d" % (inflated.tell(), size))
+    return inflated, size
+
+
+def is_compressed(section):
+    return section.compressed or section.name.startswith(".zdebug")
+
+
+class MappedElf:
+    """An ELF file, and its DWARF, read through a mapping of it"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            # mmap won't map an empty file, which isn't an ELF anyway
+            if not os.fstat(f.fileno()).st_size:
+                raise ELFError("%s is empty" % self.path)
+            # the mapping outlives the file object it was made from
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.elf_file = ELFFile(self.mapping)
+        # the mappings compressed sections were inflated into
+        self.inflated = []
+
+    def get_dwarf_info(self):
+        # pyelftools would copy every section into memory first. It also
+        # relocates the DWARF of object files, which fffc never reads, so
+        # those are left to it.
+        elf = self.elf_file
+        if elf["e_type"] == "ET_REL" or elf.has_phantom_bytes():
+            return elf.get_dwarf_info(follow_links=False)
+        gnu_compressed = bool(elf.get_section_by_name(".zdebug_info"))
+        sections = {}
+        for argument, name in dwarf_sections.items():
+            if gnu_compressed and name != ".eh_frame":
+                name = ".z" + name[1:]
+            section = elf.get_section_by_name(name)
+            sections[argument] = self.get_section(section) if section else None
+        config = DwarfConfig(
+            little_endian=elf.little_endian,
+            default_address_size=elf.elfclass // 8,
+            machine_arch=elf.get_machine_arch(),
+        )
+        return DWARFInfo(config=config, **sections)
+
+    def get_section(self, section):
+        if is_compressed(section):
+            mapping, size = inflate_section(self.elf_file, section)
+            self.inflated.append(mapping)
+            stream = SectionStream(mapping, 0, size)
+        else:
+            size = section["sh_size"]
+            stream = SectionStream(self.mapping, section["sh_offset"], size)
+        return DebugSectionDescriptor(stream, section.name, section["sh_offset"], size, section["sh_addr"])
+
+    def close(self):
+        for mapping in self.inflated:
+            mapping.close()
+        self.inflated = []
+        self.mapping.close()
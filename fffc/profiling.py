@@ -0,0 +1,193 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+profiling.py
+
+Records how long each phase of generating a fuzzer takes, how much CPU it
+uses and how much memory it peaks at, overall and for each compile unit, and
+writes it all out as JSON so that runs can be compared.
+"""
+
+import contextlib
+import json
+import resource
+import time
+import tracemalloc
+
+
+PROFILE_NAME = "fffc_profile.json"
+
+# The phases, in the order they happen
+ELF_LOAD = "elf load"
+CU_PARSE = "cu parse"
+HEADER_INFERENCE = "header inference"
+MUTATOR_INJECTION = "mutator injection"
+RUNNER_RENDERING = "runner rendering"
+MUTATOR_SOURCES = "mutator sources"
+EXCEPTIONS = "exceptions"
+BUILD = "compilation and linking"
+SCRIPTS = "scripts"
+LIBRARIES = "libraries"
+PHASES = [
+    ELF_LOAD, CU_PARSE, HEADER_INFERENCE, MUTATOR_INJECTION, RUNNER_RENDERING,
+    MUTATOR_SOURCES, EXCEPTIONS, BUILD, SCRIPTS, LIBRARIES,
+]
+
+
+def get_cpu_time():
+    # this process's CPU time plus that of every child it's waited for, which
+    # is where all of the time spent compiling goes
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class PhaseTimes:
+    """What one or more runs of a phase cost"""
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = 0
+
+    def add(self, wall, cpu, peak_memory):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.peak_memory = max(self.peak_memory, peak_memory)
+
+    def merge(self, other):
+        self.count += other.count
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "wall": round(self.wall, 6),
+            "cpu": round(self.cpu, 6),
+            "peak_memory": self.peak_memory,
+        }
+
+
+class CompileUnitProfile:
+    """The phases of a single compile unit"""
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.name = None
+        self.phases = {}
+
+    def to_dict(self):
+        return {
+            "offset": self.offset,
+            "name": self.name,
+            "phases": {name: times.to_dict() for name, times in self.phases.items()},
+        }
+
+
+class Profile:
+    """Phase by phase costs of generating a fuzzer for one target
+
+    Peak memory is what tracemalloc saw Python allocate during the phase, so
+    it doesn't count the compilers; the report also has the peak resident set
+    size of this process and of its biggest child.
+    """
+
+    def __init__(self, target):
+        self.target = str(target)
+        self.phases = {}
+        self.compile_units = []
+        self.current = None
+        self.build_steps = {}
+        self.started = time.perf_counter()
+        # only stopped again by the profile which started it
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Phases don't nest, so each can have the peak to itself.
+        tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = get_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = get_cpu_time() - cpu
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            phases = self.current.phases if self.current else self.phases
+            phases.setdefault(name, PhaseTimes()).add(wall, cpu, peak_memory)
+
+    def begin_compile_unit(self, offset):
+        self.current = CompileUnitProfile(offset)
+
+    def end_compile_unit(self, name):
+        # A worker has to hand the finished compile unit back to the parent's
+        # profile itself; see add_compile_unit.
+        cu, self.current = self.current, None
+        cu.name = name
+        self.compile_units.append(cu)
+        return cu
+
+    def add_compile_unit(self, cu):
+        self.compile_units.append(cu)
+
+    def add_build_steps(self, steps):
+        # how long was spent compiling, archiving and linking, summed over
+        # every command however many ran at once
+        for step in steps:
+            if step.duration is None:
+                continue
+            if step.is_compile():
+                kind = "compile"
+            elif step.command.startswith("ar "):
+                kind = "archive"
+            else:
+                kind = "link"
+            totals = self.build_steps.setdefault(kind, {"count": 0, "wall": 0.0})
+            totals["count"] += 1
+            totals["wall"] += step.duration
+
+    def to_dict(self):
+        # the per-CU phases are summed into the totals, so with more than one
+        # job their wall time adds up to more than actually elapsed
+        phases = {name: PhaseTimes() for name in PHASES}
+        for name, times in self.phases.items():
+            phases.setdefault(name, PhaseTimes()).merge(times)
+        for cu in self.compile_units:
+            for name, times in cu.phases.items():
+                phases.setdefault(name, PhaseTimes()).merge(times)
+        this = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "target": self.target,
+            "wall": round(time.perf_counter() - self.started, 6),
+            "max_rss_kb": this.ru_maxrss,
+            "children_max_rss_kb": children.ru_maxrss,
+            "phases": {name: times.to_dict() for name, times in phases.items() if times.count},
+            "build_steps": {
+                kind: {"count": totals["count"], "wall": round(totals["wall"], 6)}
+                for kind, totals in self.build_steps.items()
+            },
+            "compile_units": [cu.to_dict() for cu in self.compile_units],
+        }
+
+    def write(self, path):
+        with open(str(path), "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+        self.close()
+
+    def close(self):
+        # Tracing slows everything down, so it shouldn't outlive the profile,
+        # eg into the next target's generation.
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
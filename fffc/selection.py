@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+selection.py
+
+Picks out the functions to generate fuzzers for, so that fuzzing a handful of
+entry points in a big program doesn't mean processing all of it.
+"""
+
+import fnmatch
+import os.path
+import re
+
+from .utilities import expect_string_attr
+
+
+class Pattern:
+    """A glob, or a regular expression if it starts with re:"""
+
+    def __init__(self, text):
+        self.text = text
+        if text.startswith("re:"):
+            self.regex = re.compile(text[3:])
+        else:
+            self.regex = re.compile(fnmatch.translate(text))
+
+    def match(self, name):
+        return bool(name) and self.regex.fullmatch(name) is not None
+
+
+class Selection:
+    """Which functions, compile units and source files to generate for"""
+
+    def __init__(self, functions=None, compile_units=None, sources=None):
+        self.functions = [Pattern(p) for p in functions or []]
+        self.compile_units = [Pattern(p) for p in compile_units or []]
+        self.sources = [Pattern(p) for p in sources or []]
+
+    def is_everything(self):
+        return not (self.functions or self.compile_units or self.sources)
+
+    def describe(self):
+        # what goes in the manifest, so that changing it regenerates
+        if self.is_everything():
+            return None
+        return {
+            "functions": [p.text for p in self.functions],
+            "compile_units": [p.text for p in self.compile_units],
+            "sources": [p.text for p in self.sources],
+        }
+
+    @staticmethod
+    def matches_any(patterns, name):
+        # no patterns means no restriction
+        return not patterns or any(p.match(name) for p in patterns)
+
+    def wants_function(self, name):
+        return self.matches_any(self.functions, name)
+
+    def wants_compile_unit(self, cu_die):
+        name = expect_string_attr(cu_die, "DW_AT_name")
+        if not self.matches_any(self.compile_units, name):
+            return False
+        if self.sources:
+            directory = expect_string_attr(cu_die, "DW_AT_comp_dir", "")
+            source = os.path.normpath(os.path.join(directory, name or ""))
+            return self.matches_any(self.sources, source)
+        return True
+
+    def find_function_compile_units(self, elf_info, dwarf_info):
+        # The offsets of the CUs which define the selected functions, found
+        # without parsing any of them. Returns None if the ELF doesn't say
+        # where they all are, in which case every CU has to be looked at.
+        if not self.functions:
+            return None
+        aranges = dwarf_info.get_aranges()
+        symtab = elf_info.get_section_by_name(".symtab")
+        if aranges and symtab:
+            offsets = set()
+            for symbol in symtab.iter_symbols():
+                if symbol["st_info"]["type"] != "STT_FUNC":
+                    continue
+                if symbol["st_info"]["bind"] == "STB_LOCAL" or symbol["st_shndx"] == "SHN_UNDEF":
+                    continue
+                if not self.wants_function(symbol.name):
+                    continue
+                offset = aranges.cu_offset_at_addr(symbol["st_value"])
+                if offset is None:
+                    return None
+                offsets.add(offset)
+            return offsets
+        pubnames = dwarf_info.get_pubnames()
+        if pubnames:
+            return {entry.cu_ofs for name, entry in pubnames.items() if self.wants_function(name)}
+        return None
@@ -0,0 +1,267 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation.
+# SPDX-License-Identifier: MIT
+
+"""
+split_dwarf.py
+
+Finds the DWARF of programs built with -gsplit-dwarf. Their .debug_info only
+has a skeleton of each compile unit, naming the .dwo file the rest of it went
+to, or the .dwp package those were gathered into. Each split unit is only
+read when it's asked for, and only the parts of a package belonging to it.
+"""
+
+import io
+import os.path
+import struct
+
+from elftools.dwarf.dwarfinfo import DebugSectionDescriptor, DWARFInfo
+from elftools.elf.elffile import ELFFile
+
+from .die_index import DieIndex
+from .mapped_elf import inflate_section
+
+
+class SplitDwarfNotFound(Exception):
+    """Raised when the .dwo for a skeleton compile unit can't be found"""
+    def __init__(self, dwo_name, candidates):
+        self.dwo_name = dwo_name
+        self.candidates = candidates
+        msg = "Unable to find split DWARF %s; looked in %s" % (dwo_name, ", ".join(candidates))
+        super().__init__(msg)
+
+
+class UnsupportedSplitDwarf(Exception):
+    """Raised for split DWARF in a form fffc can't read"""
+    def __init__(self, name, reason):
+        self.name = name
+        super().__init__("Can't read split DWARF for %s: %s" % (name, reason))
+
+
+# The sections of a split unit, as a DWARFInfo knows them
+split_sections = {
+    "debug_info_sec": ".debug_info.dwo",
+    "debug_abbrev_sec": ".debug_abbrev.dwo",
+    "debug_str_sec": ".debug_str.dwo",
+    "debug_str_offsets_sec": ".debug_str_offsets.dwo",
+    "debug_line_sec": ".debug_line.dwo",
+    "debug_loclists_sec": ".debug_loclists.dwo",
+    "debug_rnglists_sec": ".debug_rnglists.dwo",
+}
+
+# The sections a DWARF 5 package index has a column for, by their ids
+dwp_section_ids = {
+    1: ".debug_info.dwo",
+    3: ".debug_abbrev.dwo",
+    4: ".debug_line.dwo",
+    5: ".debug_loclists.dwo",
+    6: ".debug_str_offsets.dwo",
+    8: ".debug_rnglists.dwo",
+}
+
+# The rest of the DWARFInfo's sections, which split units don't have
+other_sections = [
+    "debug_aranges_sec", "debug_frame_sec", "eh_frame_sec", "debug_loc_sec",
+    "debug_ranges_sec", "debug_pubtypes_sec", "debug_pubnames_sec",
+    "debug_line_str_sec", "debug_sup_sec", "gnu_debugaltlink_sec",
+]
+
+
+def is_gnu_skeleton(top_die):
+    # the DWARF 4 extension -gsplit-dwarf used before DWARF 5
+    return "DW_AT_GNU_dwo_name" in top_die.attributes
+
+
+def is_skeleton(cu):
+    return cu.header.get("unit_type") == "DW_UT_skeleton" or is_gnu_skeleton(cu.get_top_DIE())
+
+
+def make_section(name, data):
+    return DebugSectionDescriptor(io.BytesIO(data), name, 0, len(data), 0)
+
+
+class SplitFile:
+    """A .dwo or .dwp, opened only long enough to read the parts wanted"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            elf = ELFFile(f)
+            self.little_endian = elf.little_endian
+            # name -> (file offset, size), for reading parts of sections
+            # without reading the rest
+            self.sections = {}
+            # name -> (mapping, size) for the few sections which have to be
+            # inflated to be read
+            self.inflated = {}
+            for section in elf.iter_sections():
+                if not section.name.startswith(".debug_"):
+                    continue
+                if section.compressed:
+                    self.inflated[section.name] = inflate_section(elf, section)
+                else:
+                    self.sections[section.name] = (section["sh_offset"], section["sh_size"])
+
+    def read(self, name, offset=0, size=None):
+        if name in self.inflated:
+            mapping, section_size = self.inflated[name]
+            end = section_size if size is None else offset + size
+            return mapping[offset:end]
+        if name not in self.sections:
+            return None
+        start, section_size = self.sections[name]
+        if size is None:
+            size = section_size - offset
+        with open(self.path, "rb") as f:
+            f.seek(start + offset)
+            return f.read(size)
+
+
+class DwpIndex:
+    """Where each unit's contributions are in a .dwp"""
+
+    def __init__(self, split_file):
+        data = split_file.read(".debug_cu_index")
+        if data is None:
+            raise UnsupportedSplitDwarf(split_file.path, "no .debug_cu_index")
+        order = "<" if split_file.little_endian else ">"
+        version, columns, units, slots = struct.unpack_from(order + "IIII", data, 0)
+        if version != 5:
+            raise UnsupportedSplitDwarf(split_file.path, "index version %d" % version)
+        pos = 16
+        signatures = struct.unpack_from(order + "%dQ" % slots, data, pos)
+        pos += 8 * slots
+        rows = struct.unpack_from(order + "%dI" % slots, data, pos)
+        pos += 4 * slots
+        ids = struct.unpack_from(order + "%dI" % columns, data, pos)
+        pos += 4 * columns
+        offsets = struct.unpack_from(order + "%dI" % (units * columns), data, pos)
+        pos += 4 * units * columns
+        sizes = struct.unpack_from(order + "%dI" % (units * columns), data, pos)
+        # dwo_id -> {section name: (offset, size)}
+        self.units = {}
+        for signature, row in zip(signatures, rows):
+            if not row:
+                continue
+            start = (row - 1) * columns
+            contributions = {}
+            for column, section_id in enumerate(ids):
+                if section_id in dwp_section_ids:
+                    contributions[dwp_section_ids[section_id]] = (offsets[start + column], sizes[start + column])
+            self.units[signature] = contributions
+
+
+class SplitUnit:
+    """A split compile unit, and an index which reads its DIEs
+
+    Its strings and addresses are indices, into its own string offsets and
+    the program's addresses. The bases those are relative to are implied by
+    its skeleton rather than recorded in it, and pyelftools can't parse some
+    of the forms it uses, so its DIEs are read by a DieIndex given the bases.
+    """
+
+    def __init__(self, cu, skeleton_die):
+        self.cu = cu
+        offset_size = 8 if cu.dwarf_format() == 64 else 4
+        bases = (
+            # past the header of its string offsets
+            2 * offset_size,
+            skeleton_die.attributes["DW_AT_addr_base"].value,
+        )
+        self.index = DieIndex(cu, bases)
+
+    def get_top_DIE(self):
+        return self.index.get_die(self.cu.cu_die_offset)
+
+
+class SplitDwarf:
+    """Finds the split unit belonging to each skeleton compile unit"""
+
+    def __init__(self, target_path, dwarf_info):
+        self.target_dir = os.path.dirname(os.path.abspath(str(target_path)))
+        self.dwarf_info = dwarf_info
+        # the package is looked for where gdb would look for it
+        self.dwp = None
+        self.dwp_index = None
+        dwp_path = str(target_path) + ".dwp"
+        if os.path.exists(dwp_path):
+            self.dwp = SplitFile(dwp_path)
+            self.dwp_index = DwpIndex(self.dwp)
+        # the .debug_str.dwo of the package, which every unit shares
+        self.dwp_strings = None
+
+    def get_dwo_candidates(self, skeleton_die):
+        name = get_string(skeleton_die, "DW_AT_dwo_name")
+        comp_dir = get_string(skeleton_die, "DW_AT_comp_dir") or ""
+        # where the compiler put it, then alongside the program
+        candidates = [os.path.join(comp_dir, name)]
+        alongside = os.path.join(self.target_dir, os.path.basename(name))
+        if alongside not in candidates:
+            candidates.append(alongside)
+        return name, candidates
+
+    def get_split_unit(self, skeleton):
+        # The SplitUnit for the skeleton CU, with the program's addresses, so
+        # that its addresses can be read.
+        top_die = skeleton.get_top_DIE()
+        if is_gnu_skeleton(top_die):
+            raise UnsupportedSplitDwarf(
+                get_string(top_die, "DW_AT_GNU_dwo_name"), "only DWARF 5 split units can be read; build with -gdwarf-5"
+            )
+        dwo_id = skeleton.header["dwo_id"]
+        if self.dwp_index and dwo_id in self.dwp_index.units:
+            sections = self.read_dwp_unit(self.dwp_index.units[dwo_id])
+        else:
+            sections = self.read_dwo(top_die)
+        dwarf_info = DWARFInfo(
+            config=self.dwarf_info.config,
+            debug_addr_sec=self.dwarf_info.debug_addr_sec,
+            **sections
+        )
+        for cu in dwarf_info.iter_CUs():
+            if cu.header.get("unit_type") == "DW_UT_split_compile" and cu.header["dwo_id"] == dwo_id:
+                return SplitUnit(cu, top_die)
+        raise UnsupportedSplitDwarf(get_string(top_die, "DW_AT_dwo_name"), "no split unit with id %x" % dwo_id)
+
+    def read_dwo(self, top_die):
+        name, candidates = self.get_dwo_candidates(top_die)
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                break
+        else:
+            raise SplitDwarfNotFound(name, candidates)
+        dwo = SplitFile(candidate)
+        sections = {}
+        for attribute, section_name in split_sections.items():
+            data = dwo.read(section_name)
+            sections[attribute] = make_section(section_name, data) if data is not None else None
+        for attribute in other_sections:
+            sections[attribute] = None
+        return sections
+
+    def read_dwp_unit(self, contributions):
+        # Only this unit's parts of each section, so that its offsets into
+        # them work just as they would in its own .dwo.
+        if self.dwp_strings is None:
+            self.dwp_strings = self.dwp.read(".debug_str.dwo")
+        sections = {}
+        for attribute, section_name in split_sections.items():
+            if section_name == ".debug_str.dwo":
+                data = self.dwp_strings
+            elif section_name in contributions:
+                data = self.dwp.read(section_name, *contributions[section_name])
+            else:
+                data = None
+            sections[attribute] = make_section(section_name, data) if data is not None else None
+        for attribute in other_sections:
+            sections[attribute] = None
+        return sections
+
+
+def get_string(die, name):
+    attr = die.attributes.get(name)
+    if attr is None:
+        return None
+    value = attr.value
+    return value.decode() if isinstance(value, bytes) else value
@@ -4,14 +4,19 @@
 # SPDX-License-Identifier: MIT
 
 import base64
-import copy
+import collections
 import enum
+import hashlib
+import os
 from pathlib import Path
 import pickle
 import pkgutil
+import re
 import subprocess
+import tempfile
 import traceback
 
+import pycparser
 from pycparser import c_ast
 from pycparser.c_parser import CParser
 from pycparser.c_generator import CGenerator
@@ -20,12 +25,19 @@ from . import dwarf_to_c
 
 
 def encode_hash(obj):
-    h = abs(hash(obj))
-    b = h.to_bytes(8, byteorder="big")
-    e = base64.b16encode(b)
+    # Wide enough that two different things never get the same name in
+    # practice; write_mutator_sources and MutatorHeader check that they didn't.
+    h = hashlib.blake2b(obj.encode(), digest_size=16)
+    e = base64.b16encode(h.digest())
     return str(e, "utf-8")
 
 
+def make_unique_name(prefix, desired_name):
+    # Names are a hash of what they stand for, so they come out the same from
+    # run to run, and from process to process.
+    return prefix + encode_hash(desired_name)
+
+
 def change_declname(obj, new_name):
     if hasattr(obj, "declname"):
         obj.declname = new_name
@@ -36,12 +48,103 @@ def change_declname(obj, new_name):
         obj = obj.type
 
 
+def copy_node(node):
+    # A shallow copy; lists are the only thing in a node that gets changed in
+    # place, so those are copied too.
+    new = type(node).__new__(type(node))
+    for slot in node.__slots__:
+        if slot == "__weakref__":
+            continue
+        value = getattr(node, slot)
+        if type(value) == list:
+            value = list(value)
+        setattr(new, slot, value)
+    return new
+
+
+def copy_for_change_declname(obj):
+    # Copies just the chain of nodes change_declname walks, sharing
+    # everything hanging off it.
+    top = obj = copy_node(obj)
+    while hasattr(obj, "type"):
+        obj.type = copy_node(obj.type)
+        if hasattr(obj.type, "declname"):
+            break
+        obj = obj.type
+    return top
+
+
+def iter_nodes(node):
+    for child in node:
+        yield child
+        yield from iter_nodes(child)
+
+
+def get_parent_map(ast):
+    # id(node) -> (parent, attribute) for every node below ast
+    parents = {}
+    nodes = [ast]
+    while nodes:
+        node = nodes.pop()
+        for name, child in node.children():
+            parents[id(child)] = (node, name.split("[")[0])
+            nodes.append(child)
+    return parents
+
+
+def get_type_signature(node):
+    # A hashable stand-in for the AST under node; two ASTs with the same
+    # signature generate the same C.
+    attrs = []
+    for name in node.attr_names:
+        value = getattr(node, name)
+        if type(value) == list:
+            value = tuple(value)
+        attrs.append(value)
+    children = tuple(get_type_signature(child) for _, child in node.children())
+    return type(node), tuple(attrs), children
+
+
+class SignatureMemo:
+    """Remembers the names generated for the most recently used type
+    signatures, forgetting the least recently used past a limit"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return None
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# (desired name, mangled name) for the mutators and sizeof functions of the
+# types seen lately. Only names are kept: callers change the ASTs they get
+# back, so those are always built fresh.
+generated_names = SignatureMemo(16384)
+
+
+def get_sizeof_function_names(argument_ast):
+    key = ("sizeof", get_type_signature(argument_ast))
+    names = generated_names.get(key)
+    if names is None:
+        desired_name = CGenerator().visit(argument_ast)
+        names = (desired_name, make_unique_name("fffc_get_sizeof_", desired_name))
+        generated_names.put(key, names)
+    return names
+
+
 def make_mutator_decl_from_arg_type(
-    arg_type, generator=CGenerator(), seen={}, point=True, change_name=False
+    arg_type, generator=CGenerator(), point=True, change_name=False
 ):
-    # memoize
-    if arg_type in seen:
-        return seen[arg_type]
     mut_name = "fffc_mutator_for_target_type"
     # change the type declname
     if change_name:
@@ -59,15 +162,17 @@ def make_mutator_decl_from_arg_type(
     ret_type = c_ast.IdentifierType(["int"])
     ret_decl = c_ast.TypeDecl(mut_name, [], ret_type)
     desired_decl = c_ast.FuncDecl(arg_decl, ret_decl)
-    # now build the mangled name
-    desired_name = generator.visit(desired_decl)
-    suffix = encode_hash(desired_name)
-    actual_name = "_Z_fffc_mutator_" + suffix
+    # now build the mangled name, unless it's been built for this type lately
+    key = ("mutator", point, get_type_signature(arg_type))
+    names = generated_names.get(key)
+    if names is None:
+        desired_name = generator.visit(desired_decl)
+        names = (desired_name, make_unique_name("_Z_fffc_mutator_", desired_name))
+        generated_names.put(key, names)
+    desired_name, actual_name = names
     desired_decl.type.declname = actual_name
     # build the output
     out = c_ast.Decl(actual_name, [], [], [], desired_decl, None, None)
-    # save the result
-    seen[arg_type] = (desired_name, out)
     # and go home
     return desired_name, out
 
@@ -125,19 +230,13 @@ def get_sizeof_pointer_to_type(t, reference_ast):
         argument_ast = t.get_reference()("storage")
     else:
         argument_ast = t.define("storage")
-    prefix = "fffc_get_sizeof_"
-    desired_name = CGenerator().visit(argument_ast)
-    suffix = encode_hash(desired_name)
-    function_name = prefix + suffix
+    desired_name, function_name = get_sizeof_function_names(argument_ast)
     call = c_ast.FuncCall(c_ast.ID(function_name), reference_ast)
     return call
 
 
 def define_sizeof_type_from_ast(argument_ast):
-    prefix = "fffc_get_sizeof_"
-    desired_name = CGenerator().visit(argument_ast)
-    suffix = encode_hash(desired_name)
-    function_name = prefix + suffix
+    desired_name, function_name = get_sizeof_function_names(argument_ast)
     storage_tdecl = c_ast.Decl(
         "storage", [], [], [], c_ast.PtrDecl([], argument_ast), None, None
     )
@@ -175,10 +274,7 @@ def define_sizeof_modifier_type(t):
         argument_ast = t.get_reference()("storage")
     else:
         argument_ast = t.define("storage")
-    prefix = "fffc_get_sizeof_"
-    desired_name = CGenerator().visit(argument_ast)
-    suffix = encode_hash(desired_name)
-    function_name = prefix + suffix
+    desired_name, function_name = get_sizeof_function_names(argument_ast)
 
     # build the underlying function call
     underlying_call = get_sizeof_pointer_to_type(t.underlying_type, c_ast.ID("storage"))
@@ -207,15 +303,26 @@ def define_sizeof_do_nothing_type(t):
     return comment, funcdecl, funcdef
 
 
+def get_template_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(cache_home) / "fffc" / "templates"
+
+
 class Template:
 
     template_name = None
+    placeholder_type_name = None
+    underlying_mutator_name = None
     text = None
     ast = None
     saved_ast = None
+    sites = None
 
     _preprocessor_command = ["gcc", "-E", "-xc", "-"]
 
+    # bump this whenever what gets cached changes
+    _cache_version = 1
+
     @classmethod
     def _clean_text(cls, text):
         output_text = []
@@ -228,9 +335,12 @@ class Template:
         return "\n".join(output_text)
 
     @classmethod
-    def _load_template(cls):
+    def _read_template(cls):
         template_path = str(Path("templates") / cls.template_name)
-        raw_data = pkgutil.get_data("fffc", str(template_path))
+        return pkgutil.get_data("fffc", str(template_path))
+
+    @classmethod
+    def _load_template(cls, raw_data):
         gcc_run = subprocess.run(
             cls._preprocessor_command,
             input=raw_data,
@@ -239,70 +349,178 @@ class Template:
         )
         return cls._clean_text(gcc_run.stdout.decode())
 
+    @classmethod
+    def _get_cache_path(cls, raw_data):
+        h = hashlib.sha256()
+        h.update(str(cls._cache_version).encode() + b"\0")
+        h.update(pycparser.__version__.encode() + b"\0")
+        h.update(" ".join(cls._preprocessor_command).encode() + b"\0")
+        h.update(raw_data)
+        return get_template_cache_dir() / (cls.template_name + "." + h.hexdigest())
+
+    @classmethod
+    def _load_cached_template(cls, cache_path):
+        try:
+            with open(str(cache_path), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # missing, truncated or from some other python; just rebuild it
+            return None
+
+    @classmethod
+    def _save_cached_template(cls, cache_path, text, ast):
+        try:
+            os.makedirs(str(cache_path.parent), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(cache_path.parent), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((text, ast), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, str(cache_path))
+        except OSError:
+            # an unwritable cache just means we parse every time
+            pass
+
+    @classmethod
+    def _load_parsed_template(cls):
+        # Running the preprocessor and building a parser dominate startup, so
+        # the parsed template is kept on disk until it or pycparser changes.
+        raw_data = cls._read_template()
+        cache_path = cls._get_cache_path(raw_data)
+        cached = cls._load_cached_template(cache_path)
+        if cached:
+            return cached
+        text = cls._load_template(raw_data)
+        ast = CParser().parse(text)
+        cls._save_cached_template(cache_path, text, ast)
+        return text, ast
+
     def __new__(cls):
         if not cls.text:
-            cls.text = cls._load_template()
-            cls.parser = CParser()
+            cls.text, cls.saved_ast = cls._load_parsed_template()
+            cls.parents = get_parent_map(cls.saved_ast)
+            cls.sites = cls.find_sites(cls.saved_ast)
             cls.generator = CGenerator()
-            cls.saved_ast = cls.parser.parse(cls.text)
         return super().__new__(cls)
 
-    def __init__(self):
-        self.ast = pickle.loads(pickle.dumps(self.saved_ast))
+    @classmethod
+    def get_site_kinds(cls, node):
+        # The ways instantiating the template may rewrite node
+        kinds = []
+        if type(node) in (c_ast.Decl, c_ast.Typename):
+            try:
+                if cls.placeholder_type_name in node.type.type.names:
+                    kinds.append("placeholder")
+            except AttributeError:
+                pass
+        if type(node) == c_ast.FuncCall:
+            try:
+                if node.name.name == cls.underlying_mutator_name:
+                    kinds.append("underlying_call")
+            except AttributeError:
+                pass
+        if type(node) == c_ast.FuncDef:
+            kinds.append("funcdef")
+        return kinds
 
-    def get_nodes(self, node):
-        for child in node:
-            yield child
-            yield from self.get_nodes(child)
+    @classmethod
+    def find_sites(cls, ast):
+        # Finds everything instantiation rewrites up front, in the order a walk
+        # of the template would come across it, so that instantiating never
+        # has to walk the template itself.
+        sites = {}
+        for node in iter_nodes(ast):
+            for kind in cls.get_site_kinds(node):
+                sites.setdefault(kind, []).append(node)
+        return sites
+
+    def get_sites(self, kind):
+        return self.sites.get(kind, [])
+
+    def __init__(self):
+        # Every instance shares the parsed template. Nodes are only copied
+        # when they're about to be changed; see own().
+        self.ast = self.saved_ast
+        self.copies = {}
+
+    def own(self, node):
+        # Returns a version of node which is safe to change. For nodes of the
+        # shared template that's a copy, along with copies of its ancestors
+        # so that it can be reached from self.ast. Anything else is already
+        # ours.
+        copied = self.copies.get(id(node))
+        if copied is not None:
+            return copied
+        if node is self.saved_ast:
+            copied = self.ast = copy_node(node)
+        elif id(node) in self.parents:
+            copied = copy_node(node)
+            parent, attr = self.parents[id(node)]
+            parent = self.own(parent)
+            value = getattr(parent, attr)
+            if type(value) == list:
+                for i, item in enumerate(value):
+                    if item is node:
+                        value[i] = copied
+            else:
+                setattr(parent, attr, copied)
+        else:
+            return node
+        self.copies[id(node)] = copied
+        return copied
+
+    def own_type(self, node):
+        # Owns node and the chain of nodes change_declname walks below it
+        top = node = self.own(node)
+        while hasattr(node, "type"):
+            node = self.own(node.type)
+            if hasattr(node, "declname"):
+                break
+        return top
+
+    def change_declname(self, node, new_name):
+        change_declname(self.own_type(node), new_name)
+
+    def make_commented_mutator_defn(self, node, change_name=False):
+        # this replaces the function's decl, and may rename its argument
+        node = self.own(node)
+        self.own_type(node.decl.type.args.params[0].type)
+        return make_commented_mutator_defn(node, change_name=change_name)
 
     def replace_placeholder_type(self, dwarf_type):
-        for node in self.get_nodes(self.ast):
-            try:
-                if type(node) == c_ast.Decl:
-                    if self.placeholder_type_name in node.type.type.names:
-                        if dwarf_type.get_typename():
-                            replacement = dwarf_type.get_reference()(node.type.declname)
-                        else:
-                            replacement = dwarf_type.define(node.type.declname)
-                        node.type = replacement
-                if type(node) == c_ast.Typename:
-                    if self.placeholder_type_name in node.type.type.names:
-                        if dwarf_type.get_typename():
-                            replacement = dwarf_type.get_reference()()
-                        else:
-                            replacement = dwarf_type.define()
-                        node.type = replacement
-            except AttributeError:
-                continue
+        for node in self.get_sites("placeholder"):
+            if type(node) == c_ast.Decl:
+                args = [node.type.declname]
+            else:
+                args = []
+            if dwarf_type.get_typename():
+                replacement = dwarf_type.get_reference()(*args)
+            else:
+                replacement = dwarf_type.define(*args)
+            self.own(node).type = replacement
 
     def replace_funcs(self, dwarf_type):
         decls = []
         defn = None
         # replace the underlying call
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncCall:
-                if node.name.name == self.underlying_mutator_name:
-                    if dwarf_type.get_typename():
-                        ut = dwarf_type.get_reference()()
-                    else:
-                        ut = dwarf_type.define()
-                    underlying_mutator_name, underlying_decl_ast = make_mutator_decl_from_arg_type(
-                        ut, point=True, change_name=True
-                    )
-                    comment = "/* " + underlying_mutator_name + "*/\n"
-                    underlying_mutator_call = make_call_from_mutator_decl(
-                        "tmp", underlying_decl_ast
-                    )
-                    node.name = underlying_mutator_call.name
-                    # make this a k&r style decl, 'cause cheating is sometimes winning after all
-                    underlying_decl_ast.type.args = c_ast.ParamList([])
-                    decls.append(comment + CGenerator().visit(underlying_decl_ast))
-        # build the decl and defn
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                if not defn:
-                    decl, defn = make_commented_mutator_defn(node)
-                    decls.append(decl)
+        for node in self.get_sites("underlying_call"):
+            if dwarf_type.get_typename():
+                ut = dwarf_type.get_reference()()
+            else:
+                ut = dwarf_type.define()
+            underlying_mutator_name, underlying_decl_ast = make_mutator_decl_from_arg_type(
+                ut, point=True, change_name=True
+            )
+            comment = "/* " + underlying_mutator_name + "*/\n"
+            underlying_mutator_call = make_call_from_mutator_decl(
+                "tmp", underlying_decl_ast
+            )
+            self.own(node).name = underlying_mutator_call.name
+            # make this a k&r style decl, 'cause cheating is sometimes winning after all
+            underlying_decl_ast.type.args = c_ast.ParamList([])
+            decls.append(comment + CGenerator().visit(underlying_decl_ast))
+        # build the decl and defn from the first function
+        for node in self.get_sites("funcdef")[:1]:
+            decl, defn = self.make_commented_mutator_defn(node)
+            decls.append(decl)
         return decls, defn
 
 
@@ -323,18 +541,16 @@ class BaseMutatorTemplate(Template):
             return self.decls, self.defns
         self.decls = []
         self.defns = []
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                comment, decl, defn = self.build_sizeof(
-                    node.decl.type.args.params[0].type
-                )
-                self.decls.append(CGenerator().visit(decl))
-                self.defns.append(CGenerator().visit(defn))
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                decl, defn = make_commented_mutator_defn(node)
-                self.decls.append(decl)
-                self.defns.append(defn)
+        for node in self.get_sites("funcdef"):
+            comment, decl, defn = self.build_sizeof(
+                node.decl.type.args.params[0].type
+            )
+            self.decls.append(CGenerator().visit(decl))
+            self.defns.append(CGenerator().visit(defn))
+        for node in self.get_sites("funcdef"):
+            decl, defn = self.make_commented_mutator_defn(node)
+            self.decls.append(decl)
+            self.defns.append(defn)
         return self.decls, self.defns
 
 
@@ -343,39 +559,35 @@ class DoNothingMutatorTemplate(Template):
     template_name = "do_nothing_mutator.c"
     placeholder_type_name = "__TARGET_TYPE__"
 
-    def replace_placeholder_type(self, dwarf_type):
-        for node in self.get_nodes(self.ast):
+    @classmethod
+    def get_site_kinds(cls, node):
+        # anything with the placeholder type gets replaced here, not just decls
+        kinds = super().get_site_kinds(node)
+        if "placeholder" not in kinds:
             try:
-                if self.placeholder_type_name in node.type.type.names:
-                    if dwarf_type.get_typename():
-                        replacement = dwarf_type.get_reference()(node.type.declname)
-                    else:
-                        replacement = dwarf_type.define(node.type.declname)
-                    replacement_pointer = c_ast.PtrDecl([], replacement)
-                    node.type = replacement
-                if type(node) == c_ast.Typename:
-                    if self.placeholder_type_name in node.type.type.names:
-                        if dwarf_type.get_typename():
-                            replacement = dwarf_type.get_reference()()
-                        else:
-                            replacement = dwarf_type.define()
-                        replacement_pointer = c_ast.PtrDecl([], replacement)
-                        node.type = replacement
-            except AttributeError as ex:
-                continue
+                if cls.placeholder_type_name in node.type.type.names:
+                    kinds.append("placeholder")
+            except AttributeError:
+                pass
+        return kinds
+
+    def replace_placeholder_type(self, dwarf_type):
+        for node in self.get_sites("placeholder"):
+            if dwarf_type.get_typename():
+                replacement = dwarf_type.get_reference()(node.type.declname)
+            else:
+                replacement = dwarf_type.define(node.type.declname)
+            self.own(node).type = replacement
 
     def replace_funcs(self, dwarf_type):
         decls = []
         defns = ""
         # build the decl and defn
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                argtype = node.decl.type.args.params[0].type
-                node.decl.type.args.params[0].type = argtype
-                decl, defn = make_commented_mutator_defn(node)
-                decls.append(decl)
-                defns += defn
-                return decls, defns
+        for node in self.get_sites("funcdef")[:1]:
+            decl, defn = self.make_commented_mutator_defn(node)
+            decls.append(decl)
+            defns += defn
+            return decls, defns
 
     def inject(self, obj):
         if not obj.typename:
@@ -397,16 +609,22 @@ class ArrayMutatorTemplate(Template):
     placeholder_type_name = "__TARGET_TYPE__"
     underlying_mutator_name = "fffc_mutator_for_underlying_type"
 
+    @classmethod
+    def get_site_kinds(cls, node):
+        kinds = super().get_site_kinds(node)
+        if type(node) == c_ast.BinaryOp:
+            try:
+                if node.right.name.name == "fffc_get_sizeof_type":
+                    kinds.append("underlying_sizeof")
+            except AttributeError:
+                pass
+        return kinds
+
     def replace_underlying_sizeof(self, ut):
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.BinaryOp:
-                try:
-                    if node.right.name.name == "fffc_get_sizeof_type":
-                        node.right = get_sizeof_pointer_to_type(
-                            ut, c_ast.UnaryOp("*", c_ast.ID("storage"))
-                        )
-                except AttributeError:
-                    pass
+        for node in self.get_sites("underlying_sizeof"):
+            self.own(node).right = get_sizeof_pointer_to_type(
+                ut, c_ast.UnaryOp("*", c_ast.ID("storage"))
+            )
 
     def inject(self, pointer_type):
         if not pointer_type.underlying_type:
@@ -427,16 +645,22 @@ class PointerMutatorTemplate(Template):
     placeholder_type_name = "__TARGET_TYPE__"
     underlying_mutator_name = "fffc_mutator_for_underlying_type"
 
+    @classmethod
+    def get_site_kinds(cls, node):
+        kinds = super().get_site_kinds(node)
+        if type(node) == c_ast.Decl:
+            try:
+                if node.init.name.name == "fffc_get_sizeof_type":
+                    kinds.append("underlying_sizeof")
+            except AttributeError:
+                pass
+        return kinds
+
     def replace_underlying_sizeof(self, ut):
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.Decl:
-                try:
-                    if node.init.name.name == "fffc_get_sizeof_type":
-                        node.init = get_sizeof_pointer_to_type(
-                            ut, c_ast.UnaryOp("*", c_ast.ID("storage"))
-                        )
-                except AttributeError:
-                    pass
+        for node in self.get_sites("underlying_sizeof"):
+            self.own(node).init = get_sizeof_pointer_to_type(
+                ut, c_ast.UnaryOp("*", c_ast.ID("storage"))
+            )
 
     def inject(self, pointer_type):
         if not pointer_type.underlying_type:
@@ -508,25 +732,17 @@ class EnumMutatorTemplate(Template):
     decls = None
     defn = None
 
-    def replace_placeholder_type(self, dwarf_type):
-        for node in self.get_nodes(self.ast):
-            try:
-                if type(node) == c_ast.Decl:
-                    if self.placeholder_type_name in node.type.type.names:
-                        if dwarf_type.get_typename():
-                            replacement = dwarf_type.get_reference()(node.type.declname)
-                        else:
-                            replacement = dwarf_type.define(node.type.declname)
-                        node.type = replacement
-                if type(node) == c_ast.Typename:
-                    if self.placeholder_type_name in node.type.type.names:
-                        if dwarf_type.get_typename():
-                            replacement = dwarf_type.get_reference()()
-                        else:
-                            replacement = dwarf_type.define()
-                        node.type = replacement
-            except AttributeError:
-                continue
+    @classmethod
+    def get_site_kinds(cls, node):
+        kinds = super().get_site_kinds(node)
+        if type(node) == c_ast.Decl and node.name in ("values", "values_len", "idx"):
+            kinds.append(node.name + "_decl")
+        if type(node) == c_ast.ID and node.name in ("values", "values_len", "idx"):
+            kinds.append(node.name + "_id")
+        if type(node) == c_ast.Assignment:
+            if node.lvalue.expr.name == "storage":
+                kinds.append("storage_assignment")
+        return kinds
 
     def replace_enum_values(self, enum_object, storage_lvalue=None):
         constants = []
@@ -534,53 +750,38 @@ class EnumMutatorTemplate(Template):
             constants.append(c_ast.Constant(type="int", value=str(enum.value.value)))
         init_list = c_ast.InitList(exprs=constants)
         init_count = c_ast.Constant(type="int", value=str(len(constants)))
-        values = None
-        values_len = None
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.Decl:
-                if node.name == "values":
-                    values = node
-                if node.name == "values_len":
-                    values_len = node
-                if node.name == "idx":
-                    idx = node
-            if type(node) == c_ast.ID:
-                if node.name == "values_len":
-                    values_len_id = node
-                if node.name == "values":
-                    values_id = node
-                if node.name == "idx":
-                    idx_id = node
-            if type(node) == c_ast.Assignment:
-                if node.lvalue.expr.name == "storage":
-                    storage_expr = node
+        # the last of each is the one that gets renamed
+        values = self.own(self.get_sites("values_decl")[-1])
+        values_id = self.own(self.get_sites("values_id")[-1])
+        values_len = self.own(self.get_sites("values_len_decl")[-1])
+        values_len_id = self.own(self.get_sites("values_len_id")[-1])
+        idx = self.own(self.get_sites("idx_decl")[-1])
+        idx_id = self.own(self.get_sites("idx_id")[-1])
         values.init = init_list
         new_values_name = values.name + str(nesting_context.values_count)
         values.name = new_values_name
-        change_declname(values, new_values_name)
+        self.change_declname(values, new_values_name)
         values_id.name = new_values_name
         values_len.init = init_count
         new_values_len_name = values_len.name + str(nesting_context.values_count)
         values_len.name = new_values_len_name
-        change_declname(values_len, new_values_len_name)
+        self.change_declname(values_len, new_values_len_name)
         values_len_id.name = new_values_len_name
         new_idx_name = idx.name + str(nesting_context.values_count)
         idx.name = new_values_name
-        change_declname(idx, new_idx_name)
+        self.change_declname(idx, new_idx_name)
         idx_id.name = new_idx_name
         if storage_lvalue:
-            storage_expr.lvalue = storage_lvalue
+            self.own(self.get_sites("storage_assignment")[-1]).lvalue = storage_lvalue
         nesting_context.values_count += 1
 
     def replace_funcs(self, dwarf_type):
         decls = []
         defn = None
         # build the decl and defn
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                if not defn:
-                    decl, defn = make_commented_mutator_defn(node, change_name=True)
-                    decls.append(decl)
+        for node in self.get_sites("funcdef")[:1]:
+            decl, defn = self.make_commented_mutator_defn(node, change_name=True)
+            decls.append(decl)
         return decls, defn
 
     def do_replacements(self, obj):
@@ -689,7 +890,7 @@ class StructureMutatorTemplate(Template):
         #
         mutator_desired_name, _ = make_mutator_decl_from_arg_type(member_ast.type)
         _, mutator_decl_ast = make_mutator_decl_from_arg_type(
-            copy.deepcopy(member_ast.type), change_name=True)
+            copy_for_change_declname(member_ast.type), change_name=True)
         mutator_id = c_ast.ID(mutator_decl_ast.name)
         if not member_reference:
             member_reference = self.build_arrow_ref(member_ast.name)
@@ -715,9 +916,9 @@ class StructureMutatorTemplate(Template):
             tmp_name = "tmp_" + str(nesting_context.tmp_count)
             tmp_id = c_ast.ID(tmp_name)
             nesting_context.tmp_count += 1
-            tmp_decl = copy.deepcopy(c_ast.Decl(
-                tmp_id, None, None, None, member_ast.type, member_reference, None
-            ))
+            tmp_decl = c_ast.Decl(
+                tmp_id, None, None, None, copy_for_change_declname(member_ast.type), member_reference, None
+            )
             change_declname(tmp_decl, tmp_name)
             tmp_addr = self.take_address_of(tmp_id)
             args = c_ast.ExprList(exprs=[tmp_addr])
@@ -788,21 +989,20 @@ class StructureMutatorTemplate(Template):
             return self.decls, self.defn
         self.decls = []
         self.replace_placeholder_type(struct_object)
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                if not self.defn:
-                    for memb_mut in self.build_all_member_mutators(struct_object):
-                        node.body.block_items[-1:-1] = memb_mut
-                    try:
-                        decl, defn = make_commented_mutator_defn(node)
-                    except Exception:
-                        print("Warning: failed to generate a mutator definition.")
-                        print(node)
-                        print(struct_object)
-                        raise Exception()
-                    self.decls.append(decl)
-                    self.defn = defn
-                    break
+        for node in self.get_sites("funcdef")[:1]:
+            node = self.own(node)
+            body = self.own(node.body)
+            for memb_mut in self.build_all_member_mutators(struct_object):
+                body.block_items[-1:-1] = memb_mut
+            try:
+                decl, defn = self.make_commented_mutator_defn(node)
+            except Exception:
+                print("Warning: failed to generate a mutator definition.")
+                print(node)
+                print(struct_object)
+                raise Exception()
+            self.decls.append(decl)
+            self.defn = defn
         comment, sizedecl, sizedef = define_sizeof_type(struct_object)
         self.decls.append(CGenerator().visit(sizedecl))
         self.defn += CGenerator().visit(sizedef)
@@ -823,7 +1023,7 @@ class UnionMutatorTemplate(StructureMutatorTemplate):
         # attacker really is able to hand you a union of pointers.
         mutator_desired_name, _ = make_mutator_decl_from_arg_type(member_ast.type)
         _, mutator_decl_ast = make_mutator_decl_from_arg_type(
-            copy.deepcopy(member_ast.type), change_name=True)
+            copy_for_change_declname(member_ast.type), change_name=True)
         mutator_id = c_ast.ID(mutator_decl_ast.name)
         if not member_reference:
             member_reference = self.build_arrow_ref(member_ast.name)
@@ -918,21 +1118,20 @@ class UnionMutatorTemplate(StructureMutatorTemplate):
             return self.decls, self.defn
         self.decls = []
         self.replace_placeholder_type(union_object)
-        for node in self.get_nodes(self.ast):
-            if type(node) == c_ast.FuncDef:
-                if not self.defn:
-                    rnd = self.build_random_value(union_object)
-                    for memb_mut in self.build_all_member_mutators(union_object):
-                        node.body.block_items[-1:-1] = memb_mut
-                    node.body.block_items.insert(0, rnd)
-                    if body_only:
-                        # remove the return statement
-                        node.body.block_items.pop(-1)
-                        return node.body
-                    decl, defn = make_commented_mutator_defn(node)
-                    self.decls.append(decl)
-                    self.defn = defn
-                    break
+        for node in self.get_sites("funcdef")[:1]:
+            node = self.own(node)
+            body = self.own(node.body)
+            rnd = self.build_random_value(union_object)
+            for memb_mut in self.build_all_member_mutators(union_object):
+                body.block_items[-1:-1] = memb_mut
+            body.block_items.insert(0, rnd)
+            if body_only:
+                # remove the return statement
+                body.block_items.pop(-1)
+                return body
+            decl, defn = self.make_commented_mutator_defn(node)
+            self.decls.append(decl)
+            self.defn = defn
         comment, sizedecl, sizedef = define_sizeof_type(union_object)
         self.decls.append(CGenerator().visit(sizedecl))
         self.defn += CGenerator().visit(sizedef)
@@ -941,9 +1140,98 @@ class UnionMutatorTemplate(StructureMutatorTemplate):
         return self.decls, self.defn
 
 
+class TextTemplate:
+    """Text with named slots in it, split up once so that it can be rendered
+    in a single pass however many slots it has"""
+
+    def __init__(self, text, slots):
+        # slots maps each placeholder in the text to the name of its value
+        pattern = re.compile("|".join(
+            re.escape(placeholder) for placeholder in sorted(slots, key=len, reverse=True)
+        ))
+        self.literals = []
+        self.slots = []
+        position = 0
+        for match in pattern.finditer(text):
+            self.literals.append(text[position:match.start()])
+            self.slots.append(slots[match.group()])
+            position = match.end()
+        self.literals.append(text[position:])
+
+    def render(self, **values):
+        out = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            out.append(values[slot])
+            out.append(literal)
+        return "".join(out)
+
+
+script_slots = {
+    "___FFFC_PRELOAD___": "preload",
+    "___FFFC_EXE_PATH___": "exe_path",
+    "___FFFC_GDB_SCRIPT___": "gdb_script_path",
+}
+
+# runs the target with the fuzzer preloaded
+run_script_template = TextTemplate(
+    "#! /bin/bash\n"
+    "export FFFC_TRACING=Fals\n"
+    "export FFFC_DEBUG_REPLAY=" + ("/" * 4096) + "\n"
+    'ASAN_OPTIONS=detect_leaks=0 LD_PRELOAD="___FFFC_PRELOAD___" ___FFFC_EXE_PATH___ "$@"\n',
+    script_slots,
+)
+
+# the script gdb runs to debug the target with the fuzzer preloaded
+debugger_script_template = TextTemplate(
+    'set exec-wrapper env ASAN_OPTIONS=detect_leaks=0 LD_PRELOAD="___FFFC_PRELOAD___"\n'
+    "target exec ___FFFC_EXE_PATH___\n"
+    "set follow-fork-mode child\n"
+    "unset env LINES\n"
+    "unset env COLUMNS\n"
+    "set env _ ___FFFC_EXE_PATH___\n"
+    "run\n",
+    script_slots,
+)
+
+# the script that runs gdb on the above
+debugger_script_runner_template = TextTemplate(
+    "#! /bin/bash\n"
+    "export FFFC_TRACING=True\n"
+    """export FFFC_DEBUG_REPLAY=$(PAD=$(printf '%0.1s' "/"{1..4096}) ; echo $FFFC_DEBUG_REPLAY${PAD:${#FFFC_DEBUG_REPLAY}})\n"""
+    'gdb -x ___FFFC_GDB_SCRIPT___ ___FFFC_EXE_PATH___ "$@"',
+    script_slots,
+)
+
+
 class RunnerTemplate:
 
     template_name = "fffc_runner.c"
+    compiled = None
+
+    slots = {
+        "___FFFC_TARGET_DECL___": "target_decl",
+        "___FFFC_INFERRED_HEADER___": "inferred_header",
+        "___FFFC_TARGET_NAME___": "target_name",
+        "___FFFC_HOOK_SIG___": "hook_sig",
+        "___FFFC_PARALLEL_SIG___": "parallel_sig",
+        "___FFFC_PROXY_SIG___": "proxy_sig",
+        "___FFFC_WORKER_SIG___": "worker_sig",
+        "___FFFC_CALL___": "call",
+        "___FFFC_PROXY_CALL___": "proxy_call",
+        "___FFFC_WORKER_CALL___": "worker_call",
+        "___FFFC_RETURN___": "return_statement",
+        "___FFFC_ARGUMENT_MUTATORS___": "argument_mutators",
+        "___FFFC_OFFSET__": "offset",
+        "___FFFC_RECALCULATE_OFFSET___": "recalculate_offset",
+        "___FFFC_BINARY_PATH__": "binary_path",
+    }
+
+    def __new__(cls, *args):
+        if not cls.compiled:
+            template_path = cls._get_template_path()
+            text = pkgutil.get_data("fffc", template_path).decode("utf-8")
+            cls.compiled = TextTemplate(text, cls.slots)
+        return super().__new__(cls)
 
     def __init__(self, func, name, binary_path, executable_path, inferred_header_include, pie):
         self.generator = CGenerator()
@@ -952,8 +1240,6 @@ class RunnerTemplate:
         self.binary_path = binary_path
         self.exe_path = executable_path
         self.pie = pie
-        self.template_path = self._get_template_path()
-        self.template_data = pkgutil.get_data("fffc", str(self.template_path))
         self.inferred_header_include = inferred_header_include
         self.hook_sig = self.generator.visit(func.define("FFFC_replacement"))
         self.parallel_sig = self.generator.visit(func.define("FFFC_parallel_replacement"))
@@ -972,45 +1258,7 @@ class RunnerTemplate:
                                                                     dwarf_to_c.DwarfVoidType())
                                                 )
 
-    def replace_target_name(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_TARGET_NAME___"
-        raw = raw.replace(placeholder, bytes(self.name, "utf-8"))
-        self.template_data = raw
-
-    def replace_hook_sig(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_HOOK_SIG___"
-        raw = raw.replace(placeholder, bytes(self.hook_sig, "utf-8"))
-        self.template_data = raw
-
-    def replace_parallel_sig(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_PARALLEL_SIG___"
-        raw = raw.replace(placeholder, bytes(self.parallel_sig, "utf-8"))
-        self.template_data = raw
-
-    def replace_proxy_sig(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_PROXY_SIG___"
-        raw = raw.replace(placeholder, bytes(self.proxy_sig, "utf-8"))
-        self.template_data = raw
-
-    def replace_worker_sig(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_WORKER_SIG___"
-        raw = raw.replace(placeholder, bytes(self.worker_sig, "utf-8"))
-        self.template_data = raw
-
-    def replace_inferred_header(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_INFERRED_HEADER___"
-        raw = raw.replace(placeholder, bytes(self.inferred_header_include, "utf-8"))
-        self.template_data = raw
-
-    def replace_call(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_CALL___"
+    def build_call(self):
         if type(self.func.return_type) != dwarf_to_c.DwarfVoidType:
             tdecl = self.func.return_type.get_reference()("retval")
             init = self.func.call("FFFC_target")
@@ -1018,56 +1266,28 @@ class RunnerTemplate:
             func_call = self.generator.visit(decl)
         else:
             func_call = self.generator.visit(self.func.call("FFFC_target"))
-        raw = raw.replace(placeholder, bytes(func_call + ";", "utf-8"))
-        self.template_data = raw
-
-    def replace_proxy_call(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_PROXY_CALL___"
-        func_call = self.generator.visit(self.func.call("FFFC_proxy_target"))
-        raw = raw.replace(placeholder, bytes(func_call + ";", "utf-8"))
-        self.template_data = raw
-
-    def replace_worker_call(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_WORKER_CALL___"
-        func_call = self.generator.visit(self.func.call("FFFC_worker_target"))
-        raw = raw.replace(placeholder, bytes(func_call + ";", "utf-8"))
-        self.template_data = raw
-
-    def replace_target_decl(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_TARGET_DECL___"
+        return func_call + ";"
+
+    def build_proxy_call(self):
+        return self.generator.visit(self.func.call("FFFC_proxy_target")) + ";"
+
+    def build_worker_call(self):
+        return self.generator.visit(self.func.call("FFFC_worker_target")) + ";"
+
+    def build_target_decl(self):
         # Now you need to declare a pointer to the function whose name is FFFC_replacement
         funcref = self.func.declare("FFFC_target")
         funcptr = c_ast.PtrDecl([], funcref)
         ast = c_ast.Decl("FFFC_target", [], [], [], funcptr, None, None)
-        replacement = self.generator.visit(ast) + ";"
-        raw = raw.replace(placeholder, bytes(replacement, "utf-8"))
-        self.template_data = raw
-
-    def replace_offset(self):
-        offset = hex(self.func.low_pc)
-        raw = self.template_data
-        placeholder = b"___FFFC_OFFSET__"
-        raw = raw.replace(placeholder, bytes(offset, "utf-8"))
-        placeholder = b"___FFFC_RECALCULATE_OFFSET___"
-        raw = raw.replace(placeholder, bytes(hex(self.pie), "utf-8"))
-        self.template_data = raw
-
-    def replace_return(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_RETURN___"
+        return self.generator.visit(ast) + ";"
+
+    def build_return(self):
         if type(self.func.return_type) != dwarf_to_c.DwarfVoidType:
             ret = c_ast.Return(expr=c_ast.ID("retval"))
-            raw = raw.replace(placeholder, bytes(self.generator.visit(ret), "utf-8"))
-        else:
-            raw = raw.replace(placeholder, b"return;")
-        self.template_data = raw
+            return self.generator.visit(ret)
+        return "return;"
 
-    def replace_argument_mutators(self):
-        raw = self.template_data
-        placeholder = b"___FFFC_ARGUMENT_MUTATORS___"
+    def build_argument_mutators(self):
         mutators = []
         for arg in self.func.arguments:
             if type(arg) == c_ast.EllipsisParam:
@@ -1075,39 +1295,37 @@ class RunnerTemplate:
             call = make_commented_mutator_call_from_var(arg.name, arg.type)
             call = "\n".join("\t" + line for line in call.splitlines())
             mutators.append(call)
-        raw = raw.replace(placeholder, bytes("\n".join(mutators), "utf-8"))
-        self.template_data = raw
+        return "\n".join(mutators)
 
-    def replace_binary_path(self):
+    def build_binary_path(self):
         bin_path = str(self.binary_path)
         exe_path = str(self.exe_path)
         if (bin_path == exe_path):
             # This deals with the weirdness of dl_iterate_phdr, which notates
             # the main executable as an empty string
-            target_path = ""
-        else:
-            target_path = bin_path
-        raw = self.template_data
-        placeholder = b"___FFFC_BINARY_PATH__"
-        raw = raw.replace(placeholder, bytes(target_path, "utf-8"))
-        self.template_data = raw
+            return ""
+        return bin_path
 
-    def _get_template_path(self):
-        return str(Path("templates") / self.template_name)
+    @classmethod
+    def _get_template_path(cls):
+        return str(Path("templates") / cls.template_name)
 
     def inject(self):
-        self.replace_target_decl()
-        self.replace_inferred_header()
-        self.replace_target_name()
-        self.replace_hook_sig()
-        self.replace_parallel_sig()
-        self.replace_proxy_sig()
-        self.replace_worker_sig()
-        self.replace_call()
-        self.replace_proxy_call()
-        self.replace_worker_call()
-        self.replace_return()
-        self.replace_argument_mutators()
-        self.replace_offset()
-        self.replace_binary_path()
-        return None, str(self.template_data, "utf-8")
+        source = self.compiled.render(**{
+            "target_decl": self.build_target_decl(),
+            "inferred_header": self.inferred_header_include,
+            "target_name": self.name,
+            "hook_sig": self.hook_sig,
+            "parallel_sig": self.parallel_sig,
+            "proxy_sig": self.proxy_sig,
+            "worker_sig": self.worker_sig,
+            "call": self.build_call(),
+            "proxy_call": self.build_proxy_call(),
+            "worker_call": self.build_worker_call(),
+            "return_statement": self.build_return(),
+            "argument_mutators": self.build_argument_mutators(),
+            "offset": hex(self.func.low_pc),
+            "recalculate_offset": hex(self.pie),
+            "binary_path": self.build_binary_path(),
+        })
+        return None, source
@@ -5,51 +5,52 @@
 
 import base64
 import enum
+import hashlib
+import io
 
 from pycparser import c_ast
 from pycparser.c_generator import CGenerator
 
 
+# These are called for nearly every DIE, most often for attributes it doesn't
+# have, so they check rather than catching exceptions.
+
 def expect_string(value):
-    try:
+    if isinstance(value, bytes):
         return value.decode()
-    except Exception:
-        return value
+    return value
 
 
 def expect_int(value):
+    if value is None or type(value) == int:
+        return value
     try:
         return int(value)
     except Exception:
         return value
 
 
+def has_attr(die, attr_name):
+    return attr_name in die.attributes
+
+
 def expect_attr(die, attr_name, default=None):
-    try:
-        return die.attributes[attr_name].value
-    except Exception:
+    attr = die.attributes.get(attr_name)
+    if attr is None:
         return default
+    return attr.value
 
 
 def demand_attr(die, attr_name):
-    try:
-        return die.attributes[attr_name].value
-    except Exception as ex:
-        raise ex
+    return die.attributes[attr_name].value
 
 
 def expect_string_attr(die, attr_name, default=None):
-    try:
-        return expect_string(expect_attr(die, attr_name, default))
-    except Exception:
-        return default
+    return expect_string(expect_attr(die, attr_name, default))
 
 
 def expect_int_attr(die, attr_name, default=None):
-    try:
-        return expect_int(expect_attr(die, attr_name, default))
-    except Exception:
-        return default
+    return expect_int(expect_attr(die, attr_name, default))
 
 
 def demand_string_attr(die, attr_name):
@@ -62,21 +63,31 @@ class TypeStatus(enum.Enum):
     DONE = 3
 
 
-def build_source(statements):
-    s = ""
+def render_statement(generator, statement):
+    if isinstance(statement, c_ast.FuncDef):
+        return generator.visit(statement) + "\n"
+    elif isinstance(statement, c_ast.Pragma):
+        return generator.visit(statement) + "\n\n"
+    else:
+        return generator.visit(statement) + ";\n\n"
+
+
+def write_source(statements, f):
+    # Writes each distinct statement out as soon as it's rendered. Only a
+    # digest of each is kept to spot repeats, not the text itself.
     generator = CGenerator()
-    seen_statements = set()
+    seen_digests = set()
     for statement in statements:
-        current_statement = ""
         if not statement:
             continue
-        if isinstance(statement, c_ast.FuncDef):
-            current_statement += generator.visit(statement) + "\n"
-        elif isinstance(statement, c_ast.Pragma):
-            current_statement += generator.visit(statement) + "\n\n"
-        else:
-            current_statement += generator.visit(statement) + ";\n\n"
-        if current_statement not in seen_statements:
-            seen_statements.add(current_statement)
-            s += current_statement
-    return s
+        current_statement = render_statement(generator, statement)
+        digest = hashlib.blake2b(current_statement.encode(), digest_size=16).digest()
+        if digest not in seen_digests:
+            seen_digests.add(digest)
+            f.write(current_statement)
+
+
+def build_source(statements):
+    s = io.StringIO()
+    write_source(statements, s)
+    return s.getvalue()
@@ -17,6 +17,8 @@ setup(
     scripts=["scripts/fffc_log_inspector", "scripts/fffc_dedup_crashes", "scripts/fffc_crashtool", "scripts/fffc_internal_crashtool"],
     entry_points={"console_scripts": ["fffc = fffc.generate:main"]},
     package_data={"fffc": ["templates/*"]},
-    install_requires=["pyelftools", "pycparser", "pathlib" ],
+    # 0.31 for ELFFile.has_phantom_bytes, which mapped_elf relies on
+    install_requires=["pyelftools>=0.31", "pycparser", "pathlib" ],
+    extras_require={"zstd": ["zstandard"]},
     zip_safe=False,
 )
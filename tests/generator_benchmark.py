@@ -0,0 +1,284 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+"""
+generator_benchmark.py
+
+Times how long fffc takes to generate and build fuzzers, and how much memory
+it peaks at, for the sample programs, the c testsuite and synthetic programs
+made to stress one dimension at a time: lots of structs, lots of functions,
+and deeply nested types. Results are written as JSON, and can be compared
+against an earlier run to catch regressions, eg:
+
+    ./generator_benchmark.py -o before.json
+    (make changes)
+    ./generator_benchmark.py -o after.json --baseline before.json
+
+Each program is generated in a process of its own, so that they can't share
+caches or memory. The sample programs and testsuite have to be built first;
+see run_generator_benchmark.sh.
+"""
+
+import argparse
+import json
+import pathlib
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+SUITES = ["samples", "c_testsuite", "synthetic"]
+
+# the flags the sample programs' Makefile uses, plus keeping every type, so
+# that the structs nothing uses still count, and a language standard fffc
+# accepts whatever the compiler defaults to
+SYNTHETIC_CC = "gcc -std=c99 -g -O0 -fsanitize=address -fprofile-arcs -fPIC -fPIE -fno-common -fno-eliminate-unused-debug-types -o {out} {source}"
+
+# Each default synthetic workload scales one of structs, functions and
+# nesting depth while holding the others small.
+DEFAULT_SYNTHETIC = [
+    "structs=10,functions=4,depth=2",
+    "structs=100,functions=4,depth=2",
+    "structs=1000,functions=4,depth=2",
+    "structs=10,functions=16,depth=2",
+    "structs=10,functions=64,depth=2",
+    "structs=10,functions=4,depth=8",
+    "structs=10,functions=4,depth=32",
+]
+
+# what gets compared against the baseline
+METRICS = ["wall", "cpu", "max_rss_kb"]
+
+# differences smaller than these are noise, whatever the threshold says
+NOISE = {"wall": 0.25, "cpu": 0.25, "max_rss_kb": 1024}
+
+
+class SyntheticWorkload:
+    """A generated C program with the given numbers of structs and functions,
+    whose functions take a struct nested depth structs deep"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        values = dict(part.split("=") for part in spec.split(","))
+        self.structs = int(values.get("structs", 10))
+        self.functions = int(values.get("functions", 4))
+        self.depth = int(values.get("depth", 2))
+        if self.structs < 1 or self.functions < 1 or self.depth < 1:
+            raise ValueError("Synthetic workloads need at least one of everything: %s" % spec)
+        self.name = "synthetic_s%d_f%d_d%d" % (self.structs, self.functions, self.depth)
+
+    def get_source(self):
+        lines = ["#include <stddef.h>", ""]
+        # a chain of structs, each pointing at the one before
+        for i in range(self.structs):
+            lines.append("struct s%d {" % i)
+            lines.append("\tint number;")
+            lines.append("\tchar name[16];")
+            lines.append("\tdouble weight;")
+            if i:
+                lines.append("\tstruct s%d *previous;" % (i - 1))
+            lines.append("};")
+        # and a tower of them, each containing the one below by value
+        lines.append("struct n0 { int value; };")
+        for i in range(1, self.depth + 1):
+            lines.append("struct n%d { struct n%d inner; int value%d; };" % (i, i - 1, i))
+        lines.append("")
+        for i in range(self.functions):
+            lines.append(
+                "int f%d(struct s%d *s, struct n%d *n, int x) {"
+                % (i, i % self.structs, self.depth)
+            )
+            lines.append("\treturn x + (s ? s->number : 0) + (n ? n->value%d : 0);" % self.depth)
+            lines.append("}")
+        lines.append("")
+        lines.append("int main(void) {")
+        lines.append("\treturn 0;")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def build(self, directory):
+        source = pathlib.Path(directory) / (self.name + ".c")
+        out = source.with_suffix(".gcc")
+        with open(str(source), "w") as f:
+            f.write(self.get_source())
+        subprocess.run(SYNTHETIC_CC.format(out=out, source=source).split(), check=True)
+        return out
+
+
+def find_executables(suite):
+    # the gcc builds; see the suite's Makefile
+    return sorted((HERE / suite / "executables").glob("*.gcc"))
+
+
+def run_one(target, output, jobs):
+    # Runs in a process of its own, and prints what it measured as JSON.
+    sys.path.insert(0, str(HERE.parent))
+    # dwarf_to_c has to be imported first; see fffc.template
+    from fffc.dwarf_to_c import Executable
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    with Executable(target, target, output, False, True, jobs) as exe:
+        exe.generate_sources()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu + children.ru_utime + children.ru_stime,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "compile_units": len(exe.compile_unit_offsets),
+        "build_steps": len(exe.builder.steps),
+    }
+    print(json.dumps(result))
+
+
+def measure(target, scratch, jobs, repeat):
+    # The best of repeat runs, since anything slower was only interference.
+    best = None
+    for _ in range(repeat):
+        output = pathlib.Path(scratch) / "out"
+        shutil.rmtree(str(output), ignore_errors=True)
+        result = subprocess.run(
+            [sys.executable, __file__, "--run-one", str(target), str(output), "--jobs", str(jobs)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1:]}
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None:
+            best = run
+        else:
+            for metric in METRICS:
+                best[metric] = min(best[metric], run[metric])
+    return best
+
+
+def get_workloads(suites, synthetic, scratch):
+    # (suite, name, executable) for everything to measure
+    workloads = []
+    for suite in ["samples", "c_testsuite"]:
+        if suite not in suites:
+            continue
+        directory = "sample_programs" if suite == "samples" else suite
+        executables = find_executables(directory)
+        if not executables:
+            print("No executables in %s, skipping; run make there first." % directory, file=sys.stderr)
+        for executable in executables:
+            workloads.append((suite, executable.name, executable))
+    if "synthetic" in suites:
+        for spec in synthetic:
+            workload = SyntheticWorkload(spec)
+            workloads.append(("synthetic", workload.name, workload.build(scratch)))
+    return workloads
+
+
+def summarize(benchmarks):
+    # totals for each suite, over the programs that worked
+    suites = {}
+    for name, result in benchmarks.items():
+        if "error" in result:
+            continue
+        suite = name.split("/")[0]
+        totals = suites.setdefault(suite, dict({metric: 0 for metric in METRICS}, programs=0))
+        totals["programs"] += 1
+        totals["wall"] += result["wall"]
+        totals["cpu"] += result["cpu"]
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], result["max_rss_kb"])
+    return suites
+
+
+def compare(results, baseline, threshold):
+    # Every metric which got worse by more than threshold (a fraction) and
+    # more than the noise, as (name, metric, old, new).
+    regressions = []
+    for section in ["benchmarks", "suites"]:
+        old_section = baseline.get(section, {})
+        for name, new in results[section].items():
+            old = old_section.get(name)
+            if not old or "error" in old or "error" in new:
+                continue
+            # totals over different programs can't be compared
+            if old.get("programs") != new.get("programs"):
+                continue
+            for metric in METRICS:
+                limit = old[metric] * (1 + threshold)
+                if new[metric] > limit and new[metric] - old[metric] > NOISE[metric]:
+                    regressions.append((name, metric, old[metric], new[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks fffc's fuzzer generation.")
+    parser.add_argument(
+        "--suite", action="append", choices=SUITES, help="Only run these suites (default: all of them)."
+    )
+    parser.add_argument(
+        "--synthetic", action="append", metavar="SPEC",
+        help="A synthetic workload, eg structs=100,functions=10,depth=4 (default: a scaling series of each)."
+    )
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Jobs to give fffc.")
+    parser.add_argument("--repeat", "-r", type=int, default=1, help="Runs of each program to take the best of.")
+    parser.add_argument("--output", "-o", default="generator_benchmark.json", help="Where to write the results.")
+    parser.add_argument("--baseline", "-b", help="Earlier results to compare against.")
+    parser.add_argument(
+        "--threshold", "-t", type=float, default=0.1,
+        help="How much worse than the baseline counts as a regression, as a fraction (default: 0.1)."
+    )
+    parser.add_argument("--run-one", nargs=2, metavar=("TARGET", "OUTPUT"), help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.run_one:
+        run_one(*arguments.run_one, arguments.jobs)
+        return 0
+
+    suites = arguments.suite or SUITES
+    synthetic = arguments.synthetic or DEFAULT_SYNTHETIC
+    scratch = tempfile.mkdtemp(prefix="fffc_generator_benchmark.")
+    try:
+        benchmarks = {}
+        for suite, name, executable in get_workloads(suites, synthetic, scratch):
+            key = suite + "/" + name
+            print("Benchmarking %s ..." % key, file=sys.stderr)
+            benchmarks[key] = measure(executable, scratch, arguments.jobs, arguments.repeat)
+            if "error" in benchmarks[key]:
+                print("%s failed: %s" % (key, " ".join(benchmarks[key]["error"])), file=sys.stderr)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        "python": platform.python_version(),
+        "jobs": arguments.jobs,
+        "repeat": arguments.repeat,
+        "benchmarks": benchmarks,
+        "suites": summarize(benchmarks),
+    }
+    with open(arguments.output, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    for suite, totals in results["suites"].items():
+        print("%s: %d programs in %.2fs (%.2fs CPU), peak RSS %d KB"
+              % (suite, totals["programs"], totals["wall"], totals["cpu"], totals["max_rss_kb"]))
+
+    if not arguments.baseline:
+        return 0
+    with open(arguments.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, arguments.threshold)
+    for name, metric, old, new in regressions:
+        print("REGRESSION %s %s: %.2f -> %.2f" % (name, metric, old, new))
+    if regressions:
+        return 1
+    print("No regressions beyond %d%% of %s" % (arguments.threshold * 100, arguments.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+"""
+make_dwp.py
+
+Packs DWARF 5 .dwo files into a .dwp, eg:
+
+    ./make_dwp.py test.gcc.dwp test.gcc-*.dwo
+
+It exists because the dwp tools at hand either hang or crash on the split
+units gcc writes for DWARF 5, and run_split_dwarf.sh needs a package to read.
+It only does what that needs: 32-bit DWARF, one compile unit per .dwo, and
+each .dwo's strings copied into the package rather than merged.
+"""
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+
+from elftools.elf.elffile import ELFFile
+
+
+# The sections of a DWARF 5 package index's columns, by their ids
+section_ids = {
+    1: ".debug_info.dwo",
+    3: ".debug_abbrev.dwo",
+    4: ".debug_line.dwo",
+    5: ".debug_loclists.dwo",
+    6: ".debug_str_offsets.dwo",
+    7: ".debug_macro.dwo",
+    8: ".debug_rnglists.dwo",
+}
+
+
+def read_dwo(path):
+    with open(path, "rb") as f:
+        elf = ELFFile(f)
+        if not elf.little_endian:
+            sys.exit("%s: only little endian .dwo files can be packed" % path)
+        return {section.name: section.data() for section in elf.iter_sections()}
+
+
+def rebase_string_offsets(data, base):
+    # Past the contribution's header, every entry moves by where its strings
+    # went in the package's.
+    count = (len(data) - 8) // 4
+    offsets = struct.unpack_from("<%dI" % count, data, 8)
+    return data[:8] + struct.pack("<%dI" % count, *[offset + base for offset in offsets])
+
+
+def make_index(columns, units):
+    # units is a list of (dwo_id, [(offset, size) for each column])
+    slots = 8
+    while slots < 2 * len(units):
+        slots *= 2
+    signatures = [0] * slots
+    rows = [0] * slots
+    for row, (dwo_id, _) in enumerate(units):
+        slot = dwo_id & (slots - 1)
+        step = ((dwo_id >> 32) & (slots - 1)) | 1
+        while signatures[slot]:
+            slot = (slot + step) % slots
+        signatures[slot] = dwo_id
+        rows[slot] = row + 1
+    data = struct.pack("<IIII", 5, len(columns), len(units), slots)
+    data += struct.pack("<%dQ" % slots, *signatures)
+    data += struct.pack("<%dI" % slots, *rows)
+    data += struct.pack("<%dI" % len(columns), *columns)
+    for _, contributions in units:
+        data += struct.pack("<%dI" % len(columns), *[offset for offset, _ in contributions])
+    for _, contributions in units:
+        data += struct.pack("<%dI" % len(columns), *[size for _, size in contributions])
+    return data
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit("usage: %s package.dwp file.dwo..." % sys.argv[0])
+    output, paths = sys.argv[1], sys.argv[2:]
+    dwos = [read_dwo(path) for path in paths]
+    columns = [i for i, name in section_ids.items() if any(name in dwo for dwo in dwos)]
+    sections = {section_ids[i]: b"" for i in columns}
+    strings = b""
+    units = []
+    for path, dwo in zip(paths, dwos):
+        info = dwo[".debug_info.dwo"]
+        version, unit_type = struct.unpack_from("<HB", info, 4)
+        if version != 5 or unit_type != 5:
+            sys.exit("%s: not a DWARF 5 split compile unit" % path)
+        dwo_id = struct.unpack_from("<Q", info, 12)[0]
+        dwo[".debug_str_offsets.dwo"] = rebase_string_offsets(dwo[".debug_str_offsets.dwo"], len(strings))
+        strings += dwo[".debug_str.dwo"]
+        contributions = []
+        for i in columns:
+            name = section_ids[i]
+            data = dwo.get(name, b"")
+            contributions.append((len(sections[name]), len(data)))
+            sections[name] += data
+        units.append((dwo_id, contributions))
+    sections[".debug_str.dwo"] = strings
+    sections[".debug_cu_index"] = make_index(columns, units)
+
+    # objcopy does the ELF part: the first .dwo, with its sections swapped for
+    # the package's
+    with tempfile.TemporaryDirectory() as directory:
+        arguments = ["objcopy"]
+        for name in dwos[0]:
+            if name.startswith(".debug_"):
+                arguments += ["--remove-section", name]
+        for name, data in sections.items():
+            path = os.path.join(directory, name.strip("."))
+            with open(path, "wb") as f:
+                f.write(data)
+            arguments += ["--add-section", "%s=%s" % (name, path)]
+        subprocess.run(arguments + [paths[0], output], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+#include "shared.h"
+
+struct local1 {
+	long a;
+	char name[8];
+};
+
+int cu1_scale(struct local1 *l, int factor) {
+	return l ? (int)l->a * factor : factor;
+}
+
+struct inner {
+	long a;
+};
+
+int cu1_hold(struct holder *h) {
+	return h && h->inner ? (int)h->inner->a + h->count : 1;
+}
+
+int cu1_area(struct shape *s) {
+	return s ? s->origin.x * s->origin.y + s->count : 1;
+}
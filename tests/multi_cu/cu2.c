@@ -0,0 +1,22 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+#include "shared.h"
+
+// built with -DGROWN, this CU's DWARF gets bigger, and every CU after it moves
+struct local2 {
+	long a;
+	char name[8];
+#ifdef GROWN
+	double extra;
+	int more;
+#endif
+};
+
+int cu2_scale(struct local2 *l, int factor) {
+	return l ? (int)l->a * factor : factor;
+}
+
+int cu2_area(struct shape *s) {
+	return s ? s->origin.x * s->origin.y + s->count : 2;
+}
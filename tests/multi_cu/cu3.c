@@ -0,0 +1,26 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+#include "shared.h"
+
+struct local3 {
+	long a;
+	char name[8];
+};
+
+int cu3_scale(struct local3 *l, int factor) {
+	return l ? (int)l->a * factor : factor;
+}
+
+struct inner {
+	char tag[4];
+	double weight;
+};
+
+int cu3_hold(struct holder *h) {
+	return h && h->inner ? h->inner->tag[0] + h->count : 3;
+}
+
+int cu3_area(struct shape *s) {
+	return s ? s->origin.x * s->origin.y + s->count : 3;
+}
@@ -0,0 +1,17 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+#include "shared.h"
+
+struct local4 {
+	long a;
+	char name[8];
+};
+
+int cu4_scale(struct local4 *l, int factor) {
+	return l ? (int)l->a * factor : factor;
+}
+
+int cu4_area(struct shape *s) {
+	return s ? s->origin.x * s->origin.y + s->count : 4;
+}
@@ -0,0 +1,15 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+#include "shared.h"
+
+int main_hold(struct holder *h) {
+	return h ? h->count : 0;
+}
+
+int main(void) {
+	struct point p = {1, 2};
+	struct shape s = {{3, 4}, &p, 1};
+	return cu1_area(&s) + cu2_area(&s) + cu3_area(&s) + cu4_area(&s) +
+		cu1_hold(0) + cu3_hold(0) + main_hold(0) > 0 ? 0 : 1;
+}
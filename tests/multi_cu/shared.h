@@ -0,0 +1,28 @@
+// Copyright (C) 2020 Intel Corporation
+// SPDX-License-Identifier: MIT
+
+struct point {
+	int x;
+	int y;
+};
+
+struct shape {
+	struct point origin;
+	struct point *points;
+	int count;
+};
+
+// defined differently by cu1 and cu3, and not at all by main
+struct inner;
+
+struct holder {
+	struct inner *inner;
+	int count;
+};
+
+int cu1_area(struct shape *s);
+int cu2_area(struct shape *s);
+int cu3_area(struct shape *s);
+int cu4_area(struct shape *s);
+int cu1_hold(struct holder *h);
+int cu3_hold(struct holder *h);
@@ -6,4 +6,4 @@
 cd tiny-bignum-c
 make
 
-PYTHONHASHSEED=0 fffc build/* `mktemp -d`
+fffc build/* `mktemp -d`
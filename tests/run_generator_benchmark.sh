@@ -0,0 +1,15 @@
+#! /bin/sh
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+# Builds the sample programs and testsuite, then benchmarks generating
+# fuzzers for them and for the synthetic workloads. Any arguments are passed
+# on to generator_benchmark.py, eg to compare against an earlier run:
+#
+#   ./run_generator_benchmark.sh -o after.json --baseline before.json
+
+(cd sample_programs && make clean && make)
+(cd c_testsuite && make clean && make -j8)
+
+python3 generator_benchmark.py "$@"
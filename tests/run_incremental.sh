@@ -0,0 +1,27 @@
+#! /bin/sh
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+# Regenerates multi_cu incrementally after one of its CUs grows, moving the
+# ones after it, and checks that what was generated for them before they
+# moved was cleaned up.
+
+cd multi_cu
+make clean && make
+
+rm -rf /tmp/multi_cu && fffc --incremental multi_cu.gcc /tmp/multi_cu || exit 1
+make grown
+fffc --incremental multi_cu.gcc /tmp/multi_cu || exit 1
+
+status=0
+for cu in main cu1 cu2 cu3 cu4; do
+	for suffix in .h _mutator.c; do
+		count=`ls /tmp/multi_cu/multi_cu.gcc/0x*_$cu$suffix | wc -l`
+		if [ "$count" -ne 1 ]; then
+			echo "FAIL: $count $cu$suffix files after regenerating"
+			status=1
+		fi
+	done
+done
+exit $status
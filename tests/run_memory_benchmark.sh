@@ -0,0 +1,39 @@
+#! /bin/sh
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+# Reports the time and peak RSS it takes to read the DWARF of every compile
+# unit in the given binaries and infer their headers, eg:
+#
+#   ./run_memory_benchmark.sh /tmp/c_testsuite/executables/*.gcc
+#
+# It uses whichever fffc python finds, so two checkouts can be compared by
+# running it with each on PYTHONPATH:
+#
+#   PYTHONPATH=/path/to/before ./run_memory_benchmark.sh test.gcc
+#   PYTHONPATH=/path/to/after ./run_memory_benchmark.sh test.gcc
+
+out=$(mktemp -d /tmp/fffc_memory_benchmark.XXXXXX)
+
+for target in "$@"; do
+	python3 - "$target" "$out" <<EOF
+import resource
+import sys
+import time
+
+from fffc.dwarf_to_c import Executable
+
+target, out = sys.argv[1:]
+start = time.time()
+exe = Executable(target, target, out, False, True)
+for offset in exe.compile_unit_offsets:
+    cu = exe.get_compile_unit(offset)
+    exe.generate_header_for_cu(cu)
+elapsed = time.time() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print("%s: %d CUs in %.2fs, peak RSS %d KB" % (target, len(exe.compile_unit_offsets), elapsed, peak))
+EOF
+done
+
+rm -rf "$out"
@@ -0,0 +1,25 @@
+#! /bin/sh
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+# multi_cu's struct inner is laid out differently in cu1 and cu3, so their
+# mutators for it are private, and main can't complete it at all. Checks
+# that every runner still defines every mutator and sizeof function it
+# calls, so that nothing is left for the dynamic linker to fail to find.
+
+cd multi_cu
+make clean && make
+
+rm -rf /tmp/multi_cu && fffc multi_cu.gcc /tmp/multi_cu || exit 1
+
+status=0
+for lib in /tmp/multi_cu/multi_cu.gcc/*.so; do
+	missing=`nm -u $lib | grep -E "_Z_fffc_mutator_|fffc_get_sizeof_"`
+	if [ -n "$missing" ]; then
+		echo "FAIL: $lib leaves these undefined:"
+		echo "$missing"
+		status=1
+	fi
+done
+exit $status
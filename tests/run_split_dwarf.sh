@@ -0,0 +1,35 @@
+#! /bin/sh
+
+# Copyright (C) 2020 Intel Corporation
+# SPDX-License-Identifier: MIT
+
+# Builds multi_cu with -gsplit-dwarf and generates it twice: once reading the
+# .dwo files, then with those moved out of the way so that only a .dwp of
+# them can be read. Checks that both generate the same headers and mutators
+# for every CU.
+
+cd multi_cu
+make clean && make dwp
+
+rm -rf /tmp/multi_cu_dwo && fffc multi_cu.gcc /tmp/multi_cu_dwo || exit 1
+rm -rf dwo && mkdir dwo && mv *.dwo dwo
+rm -rf /tmp/multi_cu_dwp && fffc multi_cu.gcc /tmp/multi_cu_dwp
+generated=$?
+mv dwo/*.dwo . && rmdir dwo
+[ $generated -eq 0 ] || exit 1
+
+status=0
+for cu in main cu1 cu2 cu3 cu4; do
+	for suffix in .h _mutator.c; do
+		dwo=`ls /tmp/multi_cu_dwo/multi_cu.gcc/0x*_$cu$suffix`
+		dwp=`ls /tmp/multi_cu_dwp/multi_cu.gcc/0x*_$cu$suffix`
+		if [ -z "$dwo" ] || [ -z "$dwp" ]; then
+			echo "FAIL: no $cu$suffix generated"
+			status=1
+		elif ! cmp -s $dwo $dwp; then
+			echo "FAIL: $cu$suffix differs between the .dwo files and the .dwp"
+			status=1
+		fi
+	done
+done
+exit $status